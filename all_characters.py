@@ -1,12 +1,14 @@
-from character import find_char_in_list, Rank, Character
+from character import find_char_in_list, Rank, Character, Roster
+from profiling import instrument
 
 
-def setup() -> list[Character]:
+@instrument
+def setup() -> Roster:
     # ADDING IN ORDER OF RANK
-    all_characters = []
+    all_characters = Roster()
 
     # ALL OTHER-RANKING CHARACTERS
-    all_characters = all_characters + [
+    all_characters.extend([
         Character("Wood", Rank.OTHER, (), other=1),
         Character("Lucky Token", Rank.OTHER, ()),
         Character("Kuma TR", Rank.OTHER, ()),
@@ -18,15 +20,15 @@ def setup() -> list[Character]:
         Character("Pirate Ship", Rank.OTHER, ()),
         Character("Ancient Ship", Rank.OTHER, ()),
         Character("Rayleigh", Rank.OTHER, ()),
-    ]
+    ])
 
     # WISP CHAR
-    all_characters = all_characters + [
+    all_characters.extend([
         Character("Wisp", Rank.WISP, ())
-    ]
+    ])
 
     # ALL COMMON-RANKING CHARACTERS
-    all_characters = all_characters + [
+    all_characters.extend([
         Character("Luffy", Rank.COMMON, (find_char_in_list(all_characters, "Wisp"),)),
         Character("Zoro", Rank.COMMON, (find_char_in_list(all_characters, "Wisp"),)),
         Character("Nami", Rank.COMMON, (find_char_in_list(all_characters, "Wisp"),)),
@@ -37,10 +39,10 @@ def setup() -> list[Character]:
         Character("Gunman", Rank.COMMON, (find_char_in_list(all_characters, "Wisp"),)),
         Character("Swordsman", Rank.COMMON, (find_char_in_list(all_characters, "Wisp"),)),
 
-    ]
+    ])
 
     # ALL UNCOMMON-RANKING CHARACTERS
-    all_characters = all_characters + [
+    all_characters.extend([
         Character("Ace", Rank.UNCOMMON, (find_char_in_list(all_characters, "Luffy"),
                                          find_char_in_list(all_characters, "Gunman"))),
         Character("Robin", Rank.UNCOMMON, (find_char_in_list(all_characters, "Nami"),
@@ -64,10 +66,10 @@ def setup() -> list[Character]:
                                           find_char_in_list(all_characters, "Luffy"))),
         Character("Chopper 2", Rank.UNCOMMON, find_char_in_list(all_characters, "Chopper") * 2),
 
-    ]
+    ])
 
     # ALL SPECIAL-RANKING CHARACTERS
-    all_characters = all_characters + [
+    all_characters.extend([
         Character("Luffy 2", Rank.SPECIAL, find_char_in_list(all_characters, "Luffy") * 3),
         Character("Nami 2", Rank.SPECIAL, find_char_in_list(all_characters, "Nami") * 3),
         Character("Sanji 2", Rank.SPECIAL, find_char_in_list(all_characters, "Sanji") * 3),
@@ -147,10 +149,10 @@ def setup() -> list[Character]:
         Character("Usopp 2", Rank.SPECIAL, find_char_in_list(all_characters, "Sogeking") * 2),
         Character("Absalom", Rank.SPECIAL,
                   find_char_in_list(all_characters, "Zombie") * 3 + find_char_in_list(all_characters, "Nami")),
-    ]
+    ])
 
     # ALL RARE-RANKING CHARACTERS
-    all_characters = all_characters + [
+    all_characters.extend([
         Character("Luffy 3", Rank.RARE, (find_char_in_list(all_characters, "Luffy 2"),
                                          find_char_in_list(all_characters, "Enel"),
                                          find_char_in_list(all_characters, "Bon Clay"))),
@@ -282,10 +284,10 @@ def setup() -> list[Character]:
                                          find_char_in_list(all_characters, "Basil"),
                                          find_char_in_list(all_characters, "Arlong"))),
 
-    ]
+    ])
 
     # ALL LEGEND-RANKING CHARACTERS
-    all_characters = all_characters + [
+    all_characters.extend([
         Character("Moria 2", Rank.LEGENDARY, (find_char_in_list(all_characters, "Wood")*3,
                                               find_char_in_list(all_characters, "Oars"),
                                               find_char_in_list(all_characters, "Ryuma"),
@@ -435,28 +437,28 @@ def setup() -> list[Character]:
                                                  find_char_in_list(all_characters, "Sentomaru"),
                                                  find_char_in_list(all_characters, "Jinbe"),)),
 
-    ]
+    ])
 
 
-    # all_characters = all_characters + [
+    # all_characters.extend([
     #     Character("wisp", Rank.HIDDEN, ())
-    # ]
-    # all_characters = all_characters + [
+    # ])
+    # all_characters.extend([
     #     Character("wisp", Rank.ALTERNATE, ())
-    # ]
-    # all_characters = all_characters + [
+    # ])
+    # all_characters.extend([
     #     Character("wisp", Rank.LIMITED, ())
-    # ]
-    # all_characters = all_characters + [
+    # ])
+    # all_characters.extend([
     #     Character("wisp", Rank.IMMORTAL, ())
-    # ]
-    # all_characters = all_characters + [
+    # ])
+    # all_characters.extend([
     #     Character("wisp", Rank.TRANSCENDED, ())
-    # ]
-    # all_characters = all_characters + [
+    # ])
+    # all_characters.extend([
     #     Character("wisp", Rank.RANDOM, ())
-    # ]
-    # all_characters = all_characters + [
+    # ])
+    # all_characters.extend([
     #     Character("wisp", Rank.ETERNITY, ())
-    # ]
+    # ])
     return all_characters
@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from character import Character, Rank, Roster, find_best_char_opt, find_possible_evolutions
+from inventory import QueryCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Ranks of the generated layers, from the first one above COMMON. The last layer is the one evaluated as targets
+LAYER_RANKS = (Rank.UNCOMMON, Rank.SPECIAL, Rank.RARE, Rank.LEGENDARY,
+               Rank.HIDDEN, Rank.TRANSCENDED, Rank.IMMORTAL, Rank.ETERNITY)
+
+COMMON_NAMES = ("Luffy", "Zoro", "Nami", "Usopp", "Sanji", "Chopper", "Buggy", "Gunman", "Swordsman")
+
+# Roster sizes of the scaling suite, so a run takes seconds. Larger ones can be given with --sizes
+DEFAULT_SIZES = (150, 1000, 10000)
+
+# Batch sizes of the batch suite, around engine.PARALLEL_THRESHOLD
+BATCH_SIZES = (32, 128, 512)
+
+# Code run in a fresh interpreter for each entry point: it imports the entry point, makes its first query and
+# prints both timings, in seconds, as JSON
+STARTUP_PROBES = {
+    "main": """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+results = list(main.iter_best_char_opt(main.all_characters, ["Luffy", "Luffy", "Chopper", "Wood"], k=5))
+queried = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_query": queried - imported}))
+""",
+}
+
+
+def measure_startup(entry_point: str, runs: int = 5) -> dict[str, float]:
+    """
+    Measure how long an entry point takes to import and to answer its first query, each in a fresh interpreter.
+
+    :param entry_point: A key of STARTUP_PROBES.
+    :param runs: How many interpreters to start.
+    :return: The median import time and time-to-first-query, in milliseconds.
+    """
+    imports = []
+    first_queries = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", STARTUP_PROBES[entry_point]], cwd=BASE_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        imports.append(timings["import"] * 1000)
+        first_queries.append(timings["first_query"] * 1000)
+    return {"import_ms": statistics.median(imports), "first_query_ms": statistics.median(first_queries)}
+
+
+def run_startup(runs: int, budget_ms: float | None) -> tuple[dict, bool]:
+    """
+    Measure the startup of every entry point and check it against a budget.
+
+    :param runs: How many interpreters to start for each entry point.
+    :param budget_ms: The maximum import time plus time-to-first-query, or None for no budget.
+    :return: A tuple with the results by entry point, and False if any of them is over the budget.
+    """
+    results = {}
+    within_budget = True
+    for entry_point in STARTUP_PROBES:
+        timings = measure_startup(entry_point, runs)
+        if budget_ms is not None and timings["import_ms"] + timings["first_query_ms"] > budget_ms:
+            within_budget = False
+        results[entry_point] = timings
+    return results, within_budget
+
+
+def run_batch(sizes: tuple[int, ...], seed: int) -> dict:
+    """
+    Measure CompiledRoster.find_best_batch on the real roster, in this process and on a process pool, to find the
+    batch size from which the pool pays off. The pool gets every CPU, and at least 2 workers.
+
+    :param sizes: The batch sizes to measure.
+    :param seed: The seed of the inventories.
+    :return: The number of workers, and the in-process and pool times of each batch size, in milliseconds.
+    """
+    from snapshot import get_roster  # Only the batch suite uses the real roster
+
+    roster = get_roster()
+    compiled = roster.compiled()
+    rng = random.Random(seed)
+    names = [char.name for char in roster if char.rank in (Rank.OTHER, Rank.COMMON, Rank.UNCOMMON, Rank.SPECIAL)]
+    workers = max(2, os.cpu_count() or 1)
+    results = {"workers": workers}
+    for size in sizes:
+        inventories = [[rng.choice(names) for _ in range(rng.randint(5, 40))] for _ in range(size)]
+        start = time.perf_counter()
+        compiled.find_best_batch(inventories, max_workers=1)
+        in_process = time.perf_counter()
+        compiled.find_best_batch(inventories, max_workers=workers, parallel_threshold=0)
+        pooled = time.perf_counter()
+        results[size] = {"in_process_ms": (in_process - start) * 1000, "pool_ms": (pooled - in_process) * 1000}
+    return results
+
+
+def generate_roster(size: int = 150, fan_in: int = 3, depth: int = 4, seed: int = 0) -> Roster:
+    """
+    Generate a synthetic roster with the same structure setup() builds: Wood and Wisp, the nine commons, and then
+    one layer of recipes per rank, each using materials from the layers below it.
+
+    :param size: The total number of characters.
+    :param fan_in: The number of materials of each recipe.
+    :param depth: The number of layers above COMMON, at most len(LAYER_RANKS). The top layer uses Wood as well.
+    :param seed: The seed of the random generator, so the same arguments always give the same roster.
+    :return: The generated Roster.
+    :raises ValueError: If the depth is out of range or the size is too small for one character per layer.
+    """
+    if not 1 <= depth <= len(LAYER_RANKS):
+        raise ValueError("Expected depth between 1 and " + str(len(LAYER_RANKS)) + ", got " + str(depth))
+    rng = random.Random(seed)
+    roster = Roster([Character("Wood", Rank.OTHER, (), other=1), Character("Wisp", Rank.WISP, ())])
+    wisp = roster.get("Wisp")
+    roster.extend(Character(name, Rank.COMMON, (wisp,)) for name in COMMON_NAMES)
+    wood = roster.get("Wood")
+
+    layer_size, extra = divmod(size - len(roster), depth)
+    if layer_size < 1:
+        raise ValueError("Expected size of at least " + str(len(roster) + depth) + ", got " + str(size))
+    below = [roster.get(name) for name in COMMON_NAMES]  # Characters of the layer right below
+    lower = []  # Characters of the layers further below
+    for layer, rank in enumerate(LAYER_RANKS[:depth]):
+        layer_chars = []
+        for i in range(layer_size + (1 if layer < extra else 0)):
+            # Most materials come from the layer right below, like in the real roster
+            materials = tuple(rng.choice(lower) if lower and rng.random() < 0.2 else rng.choice(below)
+                              for _ in range(fan_in))
+            if layer == depth - 1:
+                materials = (wood * 3,) + materials
+            layer_chars.append(Character(f"{rank.name.title()} {i + 1}", rank, materials))
+        roster.extend(layer_chars)
+        lower += below
+        below = layer_chars
+    return roster
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    """
+    Get a percentile of sorted values, by the nearest-rank method.
+
+    :param sorted_values: The values, sorted in ascending order.
+    :param fraction: The percentile, between 0 and 1.
+    :return: The value at that percentile.
+    """
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))]
+
+
+def time_calls(function, arguments: list[tuple], min_time: float, max_calls: int) -> dict[str, float]:
+    """
+    Call a function with each tuple of arguments in turn, until it ran for min_time seconds or max_calls times.
+
+    :param function: The function to measure.
+    :param arguments: The tuples of arguments, used round-robin.
+    :param min_time: The minimum measuring time, in seconds.
+    :param max_calls: The maximum number of calls.
+    :return: The number of calls, the throughput in calls per second and the p50, p95 and p99 latencies in
+             microseconds.
+    """
+    latencies = []
+    total = 0.0
+    while len(latencies) < max_calls and (total < min_time or not latencies):
+        args = arguments[len(latencies) % len(arguments)]
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        latencies.append(elapsed)
+        total += elapsed
+    latencies.sort()
+    return {"calls": len(latencies), "throughput": len(latencies) / total if total else float("inf"),
+            "p50_us": _percentile(latencies, 0.50) * 1e6, "p95_us": _percentile(latencies, 0.95) * 1e6,
+            "p99_us": _percentile(latencies, 0.99) * 1e6}
+
+
+def run_scaling(sizes: tuple[int, ...], fan_in: int, depth: int, seed: int, min_time: float) -> dict:
+    """
+    Measure the public functions on synthetic rosters of growing size.
+    find_best_char_opt evaluates the LEGENDARY layer, as it does for the real roster, while get_missing_commons is
+    measured on the top layer.
+
+    :param sizes: The roster sizes to generate.
+    :param fan_in: The number of materials of each recipe.
+    :param depth: The number of layers above COMMON.
+    :param seed: The seed of the rosters and of the inventories.
+    :param min_time: The minimum measuring time of each function, in seconds.
+    :return: The results by size, then by function.
+    """
+    results = {}
+    for size in sizes:
+        start = time.perf_counter()
+        roster = generate_roster(size, fan_in, depth, seed)
+        roster.cache = QueryCache(maxsize=0)  # The inventories repeat, so the queries are measured without the cache
+        built = time.perf_counter()
+        compiled = roster.compiled()
+        compiled.users  # Built on first use, so it is timed here and not in the first query
+        compiled_at = time.perf_counter()
+
+        rng = random.Random(seed)
+        top_rank = LAYER_RANKS[depth - 1]
+        non_targets = [char for char in roster if char.rank != top_rank]
+        targets = [char for char in roster if char.rank == top_rank]
+        inventories = [[rng.choice(non_targets) for _ in range(rng.randint(5, 40))] for _ in range(50)]
+        characters = [(char,) for char in rng.sample(list(roster), min(len(roster), 500))]
+
+        def find_best(owned: list) -> None:
+            find_best_char_opt(roster, owned)
+
+        def possible_evolutions(character: Character) -> None:
+            find_possible_evolutions(roster, character)
+
+        def missing_commons(target: Character, owned: list) -> None:
+            target.get_missing_commons(list(owned))
+
+        results[size] = {
+            "build_ms": (built - start) * 1000,
+            "compile_ms": (compiled_at - built) * 1000,
+            "get_all_commons": time_calls(Character.get_all_commons, characters, min_time, 100000),
+            "get_missing_commons": time_calls(missing_commons,
+                                              [(targets[i % len(targets)], owned)
+                                               for i, owned in enumerate(inventories)], min_time, 1000),
+            "find_best_char_opt": time_calls(find_best, [(owned,) for owned in inventories], min_time, 1000),
+            "find_possible_evolutions": time_calls(possible_evolutions, characters,
+                                                   min_time, 100000),
+        }
+    return results
+
+
+def compare(results: dict, baseline: dict) -> list[str]:
+    """
+    Compare the p50 latencies of a scaling run with those of a previous run, such as one from another commit.
+
+    :param results: The result of run_scaling().
+    :param baseline: The result of run_scaling() to compare with, as read back from JSON.
+    :return: One line per size and function found in both, with the ratio of the latencies.
+    """
+    lines = []
+    for size, functions in results.items():
+        for name, timings in functions.items():
+            before = baseline.get(str(size), {}).get(name)
+            if isinstance(timings, dict) and isinstance(before, dict) and before["p50_us"]:
+                lines.append(f"{size:>7} {name:<26} {timings['p50_us'] / before['p50_us']:.2f}x p50")
+    return lines
+
+
+def main() -> int:
+    """
+    Run the benchmarks from the command line.
+
+    :return: The exit code: 1 if a budget was exceeded, otherwise 0.
+    """
+    parser = argparse.ArgumentParser(description="ORD-Helper benchmarks")
+    parser.add_argument("suite", nargs="?", choices=("startup", "scaling", "batch", "all"),
+                        default="all")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per entry point")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="fail if import time plus time-to-first-query goes over this, in milliseconds")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated synthetic roster sizes")
+    parser.add_argument("--fan-in", type=int, default=3, help="materials per synthetic recipe")
+    parser.add_argument("--depth", type=int, default=4, help="synthetic layers above COMMON")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to measure each function")
+    parser.add_argument("--compare", default=None, help="JSON output of a previous run to compare with")
+    parser.add_argument("--output", default=None, help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    report = {}
+    within_budget = True
+    if args.suite in ("startup", "all"):
+        report["startup"], within_budget = run_startup(args.runs, args.budget_ms)
+        for entry_point, timings in report["startup"].items():
+            print(f"{entry_point}: import {timings['import_ms']:.2f} ms, "
+                  f"first query {timings['first_query_ms']:.2f} ms")
+    if args.suite in ("scaling", "all"):
+        sizes = tuple(int(size) for size in args.sizes.split(","))
+        report["scaling"] = run_scaling(sizes, args.fan_in, args.depth, args.seed, args.min_time)
+        for size, functions in report["scaling"].items():
+            print(f"{size} characters: build {functions['build_ms']:.1f} ms, compile {functions['compile_ms']:.1f} ms")
+            for name, timings in functions.items():
+                if isinstance(timings, dict):
+                    print(f"  {name:<26} {timings['throughput']:>12.1f}/s  p50 {timings['p50_us']:>10.1f} us  "
+                          f"p95 {timings['p95_us']:>10.1f} us  p99 {timings['p99_us']:>10.1f} us")
+        if args.compare:
+            with open(args.compare) as baseline:
+                for line in compare(report["scaling"], json.load(baseline).get("scaling", {})):
+                    print(line)
+
+    if args.suite in ("batch", "all"):
+        report["batch"] = run_batch(BATCH_SIZES, args.seed)
+        print(f"find_best_batch with {report['batch']['workers']} workers, on {os.cpu_count()} CPUs:")
+        for size in BATCH_SIZES:
+            timings = report["batch"][size]
+            print(f"  {size:>5} inventories: in process {timings['in_process_ms']:.1f} ms, "
+                  f"pool {timings['pool_ms']:.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if not within_budget:
+        print(f"Startup over the budget of {args.budget_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
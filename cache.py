@@ -0,0 +1,254 @@
+import hashlib
+import marshal
+import os
+import sqlite3
+import threading
+import time
+
+from character import Character
+from inventory import Inventory
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(BASE_DIR, "__pycache__", "results.sqlite3")
+
+# Bump when the encoding of the stored results changes
+CACHE_FORMAT = 1
+
+# Files that compute the rankings. A change in any of them invalidates every stored result, as the same roster and
+# inventory may now rank differently
+CODE_FILES = ("character.py", "engine.py", "inventory.py")
+
+# Entries kept by a ResultCache when no size is given
+DEFAULT_MAXSIZE = 100000
+
+# A hit only records its time of use if the last one is older than this, in seconds, so most hits are pure reads
+TOUCH_INTERVAL = 60.0
+
+# Most results evicted below maxsize at once, so a full cache does not count its rows again on every insert
+EVICT_MARGIN = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    version TEXT NOT NULL,
+    ranks TEXT NOT NULL,
+    inventory BLOB NOT NULL,
+    result BLOB NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (version, ranks, inventory)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+"""
+
+
+class ResultCache:
+    """
+    A class to keep ranked find_best_char_opt results on disk, in SQLite, so they survive across sessions.
+
+    Results are keyed by the code that ranks them (code_digest()), the roster version (CompiledRoster.version), the
+    target ranks and the counts of the inventory, so a changed roster or a change in the ranking code never reads
+    the old results, which are evicted as they stop being used.
+    The database is in WAL mode, so any number of threads and processes can read while one writes.
+    As soon as an insert of this process goes beyond maxsize entries, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, maxsize: int = DEFAULT_MAXSIZE):
+        """
+        Initialize the ResultCache object, creating the database if needed.
+
+        :param path: Where the database is stored.
+        :param maxsize: The maximum number of results to keep.
+        """
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.code = code_digest()  # Hashed once, since the code does not change while it runs
+        self._local = threading.local()  # One connection per thread, as sqlite3 requires
+        self._size = 0  # Stored results as last counted, plus the inserts since then, which may replace some
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        self._size = connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        :return: The connection of the current thread, opened on first use.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, and a lost result is only recomputed
+            self._local.connection = connection
+        return connection
+
+    def get(self, compiled, inventory: Inventory) -> tuple | None:
+        """
+        Get a stored result.
+
+        :param compiled: The CompiledRoster the result is for, with its target ranks.
+        :param inventory: The owned Inventory.
+        :return: The result as (target, missing) pairs of tuples, or None if it is not stored.
+        """
+        key = (self._version(compiled), _ranks_key(compiled), inventory.counts.tobytes())
+        row = self._connection().execute(
+            "SELECT result, used FROM results WHERE version = ? AND ranks = ? AND inventory = ?", key).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > TOUCH_INTERVAL:
+            try:
+                self._connection().execute(
+                    "UPDATE results SET used = ? WHERE version = ? AND ranks = ? AND inventory = ?", (now,) + key)
+            except sqlite3.OperationalError:
+                pass  # The database is busy, and the time of use is only a hint for eviction
+        return _decode(compiled, row[0])
+
+    def put(self, compiled, inventory: Inventory, result) -> None:
+        """
+        Store a result, evicting the least recently used ones if the cache is over its size.
+
+        :param compiled: The CompiledRoster the result is for, with its target ranks.
+        :param inventory: The owned Inventory.
+        :param result: The (target, missing) pairs of find_best_char_opt.
+        """
+        key = (self._version(compiled), _ranks_key(compiled), inventory.counts.tobytes())
+        try:
+            self._connection().execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                                       key + (_encode(compiled, result), time.time()))
+        except sqlite3.OperationalError:
+            return  # The database is busy, so this result is just not stored
+        with self._lock:
+            self._size += 1
+            check = self._size > self.maxsize
+        if check:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        If the cache is beyond maxsize, delete the least recently used results, down to a margin below maxsize.
+
+        :return: The number of deleted results.
+        """
+        connection = self._connection()
+        size = connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if size <= self.maxsize:
+            with self._lock:
+                self._size = size
+            return 0
+        keep = self.maxsize - min(EVICT_MARGIN, self.maxsize // 10)
+        try:
+            connection.execute("DELETE FROM results WHERE (version, ranks, inventory) IN "
+                               "(SELECT version, ranks, inventory FROM results ORDER BY used LIMIT ?)",
+                               (size - keep,))
+        except sqlite3.OperationalError:
+            return 0  # The database is busy, so the next insert will try again
+        with self._lock:
+            self._size = keep
+        return size - keep
+
+    def clear(self, compiled=None) -> None:
+        """
+        Delete stored results.
+
+        :param compiled: Only delete the results of this CompiledRoster, with the current code, or all of them if None.
+        """
+        if compiled is None:
+            self._connection().execute("DELETE FROM results")
+            with self._lock:
+                self._size = 0
+        else:
+            self._connection().execute("DELETE FROM results WHERE version = ?", (self._version(compiled),))
+
+    def _version(self, compiled) -> str:
+        """
+        :param compiled: A CompiledRoster.
+        :return: The version of its results: the digest of the code, then the version of the roster.
+        """
+        return self.code + ":" + compiled.version
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Get the hit and miss statistics of this process.
+
+        :return: A dictionary with the hits, misses, hit rate, stored results and maximum size.
+        """
+        size = self._connection().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "size": size, "maxsize": self.maxsize}
+
+    def close(self) -> None:
+        """
+        Close the connection of the current thread.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def code_digest() -> str:
+    """
+    Hash the code that computes the rankings and the format of the stored results, so results computed by other code
+    are never used.
+
+    :return: A hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256(str(CACHE_FORMAT).encode())
+    for file_name in CODE_FILES:
+        with open(os.path.join(BASE_DIR, file_name), "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def _ranks_key(compiled) -> str:
+    """
+    :param compiled: A CompiledRoster.
+    :return: Its target ranks as a string, such as "RARE,LEGENDARY".
+    """
+    return ",".join(rank.name for rank in compiled.target_ranks)
+
+
+def _encode(compiled, result) -> bytes:
+    """
+    Serialize a result as character IDs. Missing materials are (character ID, other) pairs, so copies like Wood
+    multiplied by 3 keep their quantity.
+
+    :param compiled: The CompiledRoster of the result.
+    :param result: The (target, missing) pairs.
+    :return: The marshal bytes.
+    """
+    ids = compiled.ids
+    return marshal.dumps(tuple((ids[target.name], tuple((ids[char.name], char.other) for char in missing))
+                               for target, missing in result))
+
+
+def _decode(compiled, data: bytes) -> tuple:
+    """
+    Rebuild a result from _encode().
+
+    :param compiled: The CompiledRoster of the result.
+    :param data: The marshal bytes.
+    :return: The (target, missing) pairs, as tuples.
+    """
+    characters = compiled.characters
+    retorno = []
+    for target_id, missing_refs in marshal.loads(data):
+        missing = []
+        for char_id, other in missing_refs:
+            char = characters[char_id]
+            if other != char.other:
+                char = Character(char.name, char.rank, char.materials, char.command, other)
+            missing.append(char)
+        retorno.append((characters[target_id], tuple(missing)))
+    return tuple(retorno)
@@ -1,8 +1,14 @@
+import operator
 from collections import defaultdict
-from copy import deepcopy
 from enum import Enum, auto
+from functools import total_ordering
+from typing import Iterable, Iterator
 
+from inventory import Inventory, QueryCache
+from profiling import instrument
 
+
+@total_ordering
 class Rank(Enum):
     WISP = auto()
     OTHER = auto()
@@ -19,6 +25,24 @@ class Rank(Enum):
     ETERNITY = auto()
     RANDOM = auto()
 
+    def __lt__(self, other):
+        """
+        Order ranks by their value, so higher ranks compare as greater.
+
+        :param other: Another Rank to compare.
+        :return: True if this rank comes before the other one.
+        """
+        if isinstance(other, Rank):
+            return self.value < other.value
+        return NotImplemented
+
+
+# Ranks that are never broken down further into materials
+BASE_RANKS = frozenset({Rank.COMMON, Rank.OTHER, Rank.WISP})
+
+# Plain lists of characters whose Roster is kept by as_roster(), the most recently used ones
+LIST_ROSTERS = 8
+
 
 class Character:
     """
@@ -40,35 +64,89 @@ class Character:
         self.materials = materials
         self.command = command
         self.other = other
+        self._all_commons = None  # Flattened common materials, filled on first use
+        self._bill = None  # Name and quantity of each common material, filled on first use
 
-    def get_all_commons(self) -> list:
+    @property
+    def all_commons(self) -> tuple:
         """
-        Recursively retrieve all materials with the rank of COMMON from the character's materials list.
+        All materials with the rank of COMMON, OTHER or WISP needed by the character, with nested materials flattened.
+        It is computed once from the materials' own cached values, so the materials must not change afterwards.
+        Nested characters are filled first with an explicit stack, so deep recipes do not hit the recursion limit.
 
-        :return: A list of all common materials required by the character.
+        :return: A tuple of all common materials required by the character.
+        :raises ValueError: If the recipe uses itself, directly or indirectly.
+        """
+        if self._all_commons is None:
+            stack = [(self, iter(self.materials))]  # (character, iterator over its materials)
+            in_progress = {id(self)}
+            while stack:
+                char, materials = stack[-1]
+                for material in materials:
+                    if (isinstance(material, Character) and material.rank not in BASE_RANKS
+                            and material._all_commons is None):
+                        if id(material) in in_progress:
+                            raise ValueError("The recipe of " + material.name + " uses itself")
+                        # Fill the nested character first, then come back to the rest of these materials
+                        in_progress.add(id(material))
+                        stack.append((material, iter(material.materials)))
+                        break
+                else:
+                    stack.pop()
+                    in_progress.discard(id(char))
+                    char._all_commons = char._flatten_commons()
+        return self._all_commons
+
+    def _flatten_commons(self) -> tuple:
+        """
+        Flatten the materials one level, reusing the cached common materials of the nested characters.
+
+        :return: A tuple of all common materials required by the character.
         """
         retorno = []  # Initialize an empty list to store common materials
         for material in self.materials:
             if isinstance(material, Character):
-                # Recursively retrieve common materials from nested Character objects if they are not of a certain rank
-                if material.rank != Rank.COMMON and material.rank != Rank.OTHER and material.rank != Rank.WISP:
-                    retorno += material.get_all_commons()
+                # Reuse the cached common materials of nested Character objects if they are not of a base rank
+                if material.rank not in BASE_RANKS:
+                    retorno += material.all_commons
                 else:
                     retorno.append(material)
             else:
                 # If the material is not a Character, simply add it to the list
                 retorno.append(material)
-        return retorno
+        return tuple(retorno)
+
+    @property
+    def bill(self) -> tuple[tuple[str, int], ...]:
+        """
+        The multiset of common materials needed by the character, as (name, quantity) pairs in order of first use.
+        Quantities take the "other" attribute into account, so three Wood count as 3.
+
+        :return: A tuple of (name, quantity) pairs.
+        """
+        if self._bill is None:
+            self._bill = count_materials(self.all_commons)
+        return self._bill
+
+    @instrument
+    def get_all_commons(self) -> list:
+        """
+        Retrieve all materials with the rank of COMMON from the character's materials list, including nested ones.
 
+        :return: A list of all common materials required by the character.
+        """
+        return list(self.all_commons)
+
+    @instrument
     def get_repr_all_commons(self) -> str:
         """
         Get a string representation of all common materials required by the character.
 
         :return: A string listing all common materials and their quantities.
         """
-        comms = self.get_all_commons()  # Retrieve all common materials
-        return format_missing_char(comms)
+        return format_bill(self.bill)
 
+    @instrument
     def get_missing_commons(self, owned: list) -> list:
         """
         Determine which common materials are still needed, based on a list of owned materials.
@@ -77,14 +155,19 @@ class Character:
         :return: A list of common materials that are still missing.
         """
         retorno = []  # Initialize an empty list to store missing common materials
-        for material in self.materials:
-            if material in owned:
-                owned.remove(material)  # Remove owned materials from the list
-            elif material.rank != Rank.COMMON and material.rank != Rank.OTHER and material.rank != Rank.WISP:
-                # Recursively check for missing commons in nested Character objects
-                retorno += material.get_missing_commons(owned)
+        stack = [iter(self.materials)]  # Iterators over the materials being checked, innermost last
+        while stack:
+            for material in stack[-1]:
+                if material in owned:
+                    owned.remove(material)  # Remove owned materials from the list
+                elif material.rank not in BASE_RANKS:
+                    # Check the nested Character object first, then come back to the rest of these materials
+                    stack.append(iter(material.materials))
+                    break
+                else:
+                    retorno.append(material)  # Add missing materials to the list
             else:
-                retorno.append(material)  # Add missing materials to the list
+                stack.pop()
 
         return retorno
 
@@ -181,9 +264,168 @@ class Character:
         return f"{self.name}"
 
 
-def find_char_in_list(char_list: list[Character], string: str) -> Character:
+class Roster:
+    """
+    An ordered collection of Character objects with a name index, so lookups by name take constant time.
+    """
+
+    def __init__(self, characters: Iterable[Character] = ()):
+        """
+        Initialize the Roster object.
+
+        :param characters: The Character objects to add, in order of rank.
+        """
+        self._characters = []
+        self._index = {}
+        self._compiled = None  # CompiledRoster, built on first use and dropped when the roster changes
+        self.cache = QueryCache()  # Results of find_best_char_opt and find_possible_evolutions, cleared on changes
+        self.persistent = None  # Optional cache.ResultCache of find_best_char_opt results, keyed by roster version
+        self.extend(characters)
+
+    def append(self, character: Character) -> None:
+        """
+        Add a Character to the end of the roster and index it by name.
+        If the name is already indexed, the first Character keeps the name, as a linear search would.
+
+        :param character: The Character to add.
+        """
+        self._characters.append(character)
+        self._index.setdefault(character.name, character)
+        self._compiled = None
+        if self.cache:
+            self.cache.clear()
+        character.bill  # Characters are added in order of rank, so the bills are built bottom-up
+
+    def extend(self, characters: Iterable[Character]) -> None:
+        """
+        Add several Character objects to the end of the roster.
+
+        :param characters: The Character objects to add.
+        """
+        for character in characters:
+            self.append(character)
+
+    def get(self, name: str) -> Character:
+        """
+        Get a Character by name.
+
+        :param name: The name of the Character to find.
+        :return: The Character object with the matching name.
+        :raises NameError: If the Character is not in the roster.
+        """
+        try:
+            return self._index[name]
+        except KeyError:
+            raise NameError("Character not found") from None
+
+    def get_many(self, names: Iterable[str]) -> list[Character]:
+        """
+        Get several Character objects by name, in the same order as the names.
+
+        :param names: The names of the Character objects to find.
+        :return: A list with the Character object for each name.
+        :raises NameError: If any of the names is not in the roster.
+        """
+        index = self._index
+        try:
+            return [index[name] for name in names]
+        except KeyError:
+            raise NameError("Character not found") from None
+
+    def compiled(self, target_rank: Rank | Iterable[Rank] = Rank.LEGENDARY):
+        """
+        Get the compiled form of the roster, used to evaluate owned inventories.
+        The roster is compiled once, and the targets of each rank are added the first time a query asks for them.
+
+        :param target_rank: The rank, or ranks, of the characters to evaluate as targets.
+        :return: A CompiledRoster, built the first time it is needed after the roster changes.
+        """
+        if self._compiled is None:
+            from engine import CompiledRoster  # The engine module depends on this one
+            self._compiled = CompiledRoster(self._characters, target_rank)
+        return self._compiled.view(target_rank)
+
+    def use_compiled(self, compiled) -> None:
+        """
+        Use an already compiled form of the roster, such as one loaded from a snapshot.
+
+        :param compiled: A CompiledRoster built from the Character objects of this roster.
+        """
+        self._compiled = compiled
+
+    def __contains__(self, item):
+        """
+        Check if a Character, or a name, is in the roster.
+
+        :param item: A string or Character object to look for.
+        :return: True if the name is indexed, otherwise False.
+        """
+        if isinstance(item, Character):
+            item = item.name
+        return item in self._index
+
+    def __iter__(self):
+        """
+        Iterate over the Character objects in the order they were added.
+        """
+        return iter(self._characters)
+
+    def __len__(self):
+        """
+        :return: The number of Character objects in the roster.
+        """
+        return len(self._characters)
+
+    def __getitem__(self, item):
+        """
+        Get a Character, or a list of Character objects, by position.
+
+        :param item: An integer index or a slice.
+        :return: The Character object, or list of Character objects, at that position.
+        """
+        return self._characters[item]
+
+    def __repr__(self):
+        """
+        Define the formal representation of the Roster.
+
+        :return: The Roster with the names of its Character objects.
+        """
+        return f"Roster({self._characters!r})"
+
+
+_list_rosters = QueryCache(LIST_ROSTERS)  # id(list) -> (list, its characters, Roster)
+
+
+def as_roster(char_list: list[Character] | Roster) -> Roster:
+    """
+    Get the Roster of a list of characters, so the functions that take a plain list use the compiled form too.
+    A Roster is returned as it is. The Roster of a plain list is kept, with its compiled form and caches, and reused
+    by the next calls with the same list as long as it holds the same Character objects in the same order.
+
+    :param char_list: A list of Character objects, or a Roster.
+    :return: The Roster.
+    """
+    if isinstance(char_list, Roster):
+        return char_list
+    if not isinstance(char_list, (list, tuple)):
+        return Roster(char_list)  # Iterators cannot be looked at twice, so they are not kept
+    entry = _list_rosters.get(id(char_list))
+    # The list itself is kept in the entry, so its id cannot be reused by another list while the entry exists
+    if (entry is not None and entry[0] is char_list and len(entry[1]) == len(char_list)
+            and all(map(operator.is_, entry[1], char_list))):
+        return entry[2]
+    members = tuple(char_list)
+    roster = Roster(members)
+    _list_rosters.put(id(char_list), (char_list, members, roster))
+    return roster
+
+
+@instrument
+def find_char_in_list(char_list: list[Character] | Roster, string: str) -> Character:
     """
     Search for a Character in a list by name.
+    If the list is a Roster, its name index is used instead of a linear search.
 
     :param char_list: The list of Character objects to search through.
     :param string: The name of the Character to find.
@@ -191,37 +433,101 @@ def find_char_in_list(char_list: list[Character], string: str) -> Character:
     :raises NameError: If the Character is not found in the list.
     """
 
+    if isinstance(char_list, Roster):
+        return char_list.get(string)
     for character in char_list:
         if character.name == string:
             return character
     raise NameError("Character not found")
 
 
-def find_best_char_opt(char_list: list[Character], owned: list[Character]) -> list[tuple[Character, list]]:
+@instrument
+def find_best_char_opt(char_list: list[Character], owned: list[Character],
+                       rank: Rank | Iterable[Rank] = Rank.LEGENDARY) -> list[tuple[Character, list]]:
     """
     Find the best Character options based on which have the fewest missing common materials.
+    Numeric resources like Wood are counted in units, so owning one Wood does not cover a recipe that needs three.
 
     :param char_list: The list of potential Character objects to evaluate.
-    :param owned: A list of already owned Character objects.
+    :param owned: A list of already owned Character objects, or an Inventory.
+    :param rank: The rank, or ranks, of the characters to evaluate.
     :return: A sorted list of tuples, each containing a Character and a list of its missing common materials.
     """
 
-    best_chars = [char for char in char_list if char.rank == Rank.LEGENDARY]  # Filter characters with the best rank
-    # Determine missing materials for each character
-    missings = [(char, char.get_missing_commons(deepcopy(owned))) for char in best_chars]
-    retorno = sorted(missings, key=lambda x: len(x[1]))  # Sort the characters by the number of missing materials
+    roster = as_roster(char_list)
+    compiled = roster.compiled(rank)
+    # The same inventory in any order gives the same key, so repeated queries on a Roster come from its cache
+    inventory = Inventory(compiled, owned)
+    key = ("best", compiled.target_ranks, inventory)
+    retorno = roster.cache.get(key)
+    if retorno is None:
+        if roster.persistent is not None:
+            retorno = roster.persistent.get(compiled, inventory)
+        if retorno is None:
+            # The compiled roster evaluates every target of the rank on count vectors, without copying the owned list
+            retorno = tuple((target, tuple(missing)) for target, missing in compiled.find_best(inventory))
+            if roster.persistent is not None:
+                roster.persistent.put(compiled, inventory, retorno)
+        roster.cache.put(key, retorno)
+    return [(target, list(missing)) for target, missing in retorno]
+
+
+@instrument
+def iter_best_char_opt(char_list: list[Character], owned: list[Character], k: int = 5,
+                       rank: Rank | Iterable[Rank] = Rank.LEGENDARY) -> Iterator[tuple[Character, list]]:
+    """
+    Yield the best Character options one at a time, in the same order as find_best_char_opt, up to k of them.
+    Only the targets that can still be among the best ones are evaluated, as the options are consumed, so this is a
+    generator itself and the profiler times the evaluation and not only the creation of the generator.
 
-    return retorno
+    :param char_list: The list of potential Character objects to evaluate.
+    :param owned: A list of already owned Character objects.
+    :param k: The maximum number of options to yield.
+    :param rank: The rank, or ranks, of the characters to evaluate.
+    :return: A generator of tuples, each containing a Character and a list of its missing common materials.
+    """
+    roster = as_roster(char_list)
+    yield from roster.compiled(rank).iter_best(owned, k)
 
 
-def format_missing_char(chars: list[Character]) -> str:
+@instrument
+def find_best_char_opt_batch(char_list: list[Character], owned_list: Iterable[list[Character]],
+                             max_workers: int | None = None,
+                             rank: Rank | Iterable[Rank] = Rank.LEGENDARY) -> list[list[tuple[Character, list]]]:
     """
-    Generate a formatted string that lists the names of characters and their counts from a given list of Character objects.
+    Find the best Character options for many owned inventories at once, such as every player in a lobby.
+    Large batches are evaluated on a process pool.
+
+    :param char_list: The list of potential Character objects to evaluate.
+    :param owned_list: The owned inventories, each a list of already owned Character objects.
+    :param max_workers: The number of worker processes for large batches. Defaults to the number of CPUs.
+    :param rank: The rank, or ranks, of the characters to evaluate.
+    :return: One result of find_best_char_opt for each inventory, in the same order.
+    """
+    roster = as_roster(char_list)
+    return roster.compiled(rank).find_best_batch(owned_list, max_workers=max_workers)
+
+
+def get_quantity(character: Character) -> int:
+    """
+    Get how many units a Character stands for.
+
+    :param character: The Character to check.
+    :return: The "other" attribute for numeric resources like Wood and Gold, otherwise 1.
+    """
+    other = character.other
+    if isinstance(other, int) and not isinstance(other, bool) and other > 0:
+        return other
+    return 1
+
+
+def count_materials(chars: Iterable[Character]) -> tuple[tuple[str, int], ...]:
+    """
+    Count the quantity of each Character name in a list of Character objects.
 
     :param chars: A list of Character objects, potentially containing duplicates.
-    :return: A string that represents the characters and their counts in the format "[xN Name, xM Name, ...]".
+    :return: A tuple of (name, quantity) pairs, in order of first appearance.
     """
-    retorno = "["  # Initialize the string representation
     name_count = defaultdict(int)  # Dictionary to count occurrences of each character's name
 
     # Iterate over the list of Character objects
@@ -231,45 +537,53 @@ def format_missing_char(chars: list[Character]) -> str:
         else:
             name_count[character.name] += 1  # Increment the count for each character name
 
+    return tuple(name_count.items())
+
+
+def format_bill(bill: Iterable[tuple[str, int]]) -> str:
+    """
+    Generate a formatted string from (name, quantity) pairs, such as the ones in Character.bill.
+
+    :param bill: The (name, quantity) pairs to format.
+    :return: A string that represents the characters and their counts in the format "[xN Name, xM Name, ...]".
+    """
+    retorno = "["  # Initialize the string representation
+
     # Build the formatted string with character names and their respective counts
-    for name, count in name_count.items():
+    for name, count in bill:
         retorno += "x" + str(count) + " " + name + ", "  # Append the count and name to the string
 
     return retorno[:-2] + "]"  # Return the string, removing the trailing comma and space, and closing with a bracket
 
 
+def format_missing_char(chars: list[Character]) -> str:
+    """
+    Generate a formatted string that lists the names of characters and their counts from a given list of Character objects.
+
+    :param chars: A list of Character objects, potentially containing duplicates.
+    :return: A string that represents the characters and their counts in the format "[xN Name, xM Name, ...]".
+    """
+    return format_bill(count_materials(chars))
+
+
+@instrument
 def find_possible_evolutions(all_characters: list[Character], character: Character) -> list[Character]:
     """
     Finds and returns a list of characters for which the given character can serve as a material,
     either directly or indirectly (through recursive chains of materials).
 
     The results are sorted by the rank of the characters in descending order, with higher-ranked characters appearing first.
+    Characters of the same rank keep their order in the list.
 
     :param all_characters: A list of all possible characters in the game.
     :param character: The character to check as a potential material for others.
     :return: A sorted list of characters that can use the given character as a material, directly or indirectly.
     """
-    # filtered = list(filter(lambda char_: char_.rank == Rank.LEGENDARY, all_characters))
-    filtered = all_characters
-
-    # Helper function to perform recursive search
-    def is_material_for(target: Character, material: Character) -> bool:
-        # Base case: if the material is directly in the target's materials
-        if material.rank > target.rank:
-            return False
-        if target.rank == material.rank:
-            return target == material
-        # Recursive case: check if the material is indirectly used in the target's materials
-        for sub_material in target.materials:
-            if is_material_for(sub_material, material):
-                return True
-        return False
-
-    possible_evolutions = []
-
-    # Iterate over all characters in the list
-    for char in filtered:
-        if is_material_for(char, character):
-            possible_evolutions.append(char)
-
-    return possible_evolutions
+    roster = as_roster(all_characters)
+    key = ("evolutions", character if isinstance(character, str) else character.name)
+    retorno = roster.cache.get(key)
+    if retorno is None:
+        # The compiled roster walks the characters that use this one, and each of their users in turn
+        retorno = tuple(roster.compiled().find_possible_evolutions(character))
+        roster.cache.put(key, retorno)
+    return list(retorno)
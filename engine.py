@@ -0,0 +1,739 @@
+import copy
+import hashlib
+import math
+import os
+import heapq
+from array import array
+from typing import Callable, Iterable, Iterator
+
+from character import BASE_RANKS, Character, Rank, get_quantity
+from inventory import Inventory, QueryCache
+from profiling import instrument
+
+# Batches with fewer inventories than this are evaluated without a process pool. On the real roster, ranking one
+# inventory takes about 1.3 ms, starting a pool 12 to 50 ms and sending an inventory to a worker and its result back
+# about 0.8 ms, so with 4 workers a pool breaks even at around 20 to 90 inventories. `python benchmark.py batch`
+# measures the crossover on the current machine
+PARALLEL_THRESHOLD = 128
+
+# Results of CompiledRoster.evolutions() kept per roster
+EVOLUTION_QUERIES = 1024
+
+
+class CompiledRoster:
+    """
+    A compiled form of a roster, built once and reused by every query.
+
+    Each character gets an integer ID (its position in the roster) and each base material (COMMON, OTHER or WISP)
+    gets a column. Every target has a row in the requirement matrix, with how many of each base material it needs,
+    and a flat program of its recipe tree, so owned inventories are evaluated as count vectors instead of lists.
+
+    Numeric resources, like Wood and Gold, are counted in units everywhere: three Wood in a recipe need three
+    owned Wood, and owning one of them covers one third of the requirement.
+
+    Compiling validates the roster and numbers the characters in topological order, so every character comes after
+    its materials and all the indexes are built bottom-up in single passes, without recursion.
+
+    Targets are partitioned by rank: the requirement rows and programs of each rank are built the first time a query
+    asks for that rank, and view() gives a CompiledRoster for any set of target ranks that shares every index with
+    this one, so a query for one tier only touches the data of that tier.
+    """
+
+    @instrument
+    def __init__(self, characters: Iterable[Character], target_rank: Rank | Iterable[Rank] = Rank.LEGENDARY,
+                 state: tuple = None):
+        """
+        Compile a list of Character objects.
+
+        :param characters: The Character objects of the roster, usually in order of rank.
+        :param target_rank: The rank, or ranks, of the characters to evaluate as targets.
+        :param state: The result of get_state() for the same characters, to skip compiling them again.
+        :raises ValueError: If the roster is not valid, as checked by compile_order(), or no target rank is given.
+        """
+        characters = list(characters)
+        self.order = compile_order(characters) if state is None else list(state[0])
+        self.characters = [characters[position] for position in self.order]  # Character ID -> Character
+        self.ids = {}  # Name -> character ID. The first character keeps the name, as a linear search would
+        for char_id, char in enumerate(self.characters):
+            self.ids.setdefault(char.name, char_id)
+
+        # Base materials are the columns of the requirement matrix
+        self.materials = [char for char in self.characters if char.rank in BASE_RANKS]
+        self.columns = array("l", [-1] * len(self.characters))  # Character ID -> column, -1 if not a base material
+        for column, material in enumerate(self.materials):
+            self.columns[self.ids[material.name]] = column
+
+        self.by_rank = {}  # Rank -> IDs of the characters of that rank, in order
+        for char_id, char in enumerate(self.characters):
+            self.by_rank.setdefault(char.rank, []).append(char_id)
+
+        # Indexes built on first use. Views share them through _base, and share the caches of partitions and views
+        self._base = self
+        self._rows = None  # Character ID -> base materials of its recipe
+        self._users = None  # Reverse-dependency index: character ID -> IDs of its direct users
+        self._evolutions = None  # QueryCache of the results of evolutions()
+        self._version = None  # Digest of the characters and recipes
+        self._partitions = {}  # Rank -> (target IDs, requirement rows, programs)
+        self._views = {}  # Target ranks -> CompiledRoster
+        if state is not None:
+            self._set_state(state)
+        self._select(target_ranks(target_rank))
+        self._views[self.target_ranks] = self
+
+    def view(self, target_rank: Rank | Iterable[Rank]) -> "CompiledRoster":
+        """
+        Get the compiled roster for other target ranks, sharing the indexes of this one.
+
+        :param target_rank: The rank, or ranks, of the characters to evaluate as targets.
+        :return: A CompiledRoster, built the first time those ranks are asked for.
+        :raises ValueError: If no target rank is given.
+        """
+        ranks = target_ranks(target_rank)
+        views = self._base._views
+        view = views.get(ranks)
+        if view is None:
+            view = copy.copy(self._base)  # A shallow copy shares every index and the cache of partitions
+            view._select(ranks)
+            views[ranks] = view
+        return view
+
+    @property
+    def version(self) -> str:
+        """
+        A digest of every character and recipe, in order of character ID. It changes whenever the roster does, so
+        results stored with it, such as in a persistent cache, are never used for another roster. Built on first use.
+        """
+        base = self._base
+        if base._version is None:
+            digest = hashlib.sha256()
+            for char in base.characters:
+                materials = tuple((material.name, material.other) for material in char.materials)
+                digest.update(repr((char.name, char.rank.name, char.other, materials)).encode())
+            base._version = digest.hexdigest()
+        return base._version
+
+    def partition(self, rank: Rank) -> tuple[list[int], list[array], list[tuple]]:
+        """
+        Get the targets of one rank with their requirement rows and programs, built the first time they are needed.
+
+        :param rank: The rank of the targets.
+        :return: A tuple with the target IDs, their requirement rows and their programs, in order of character ID.
+        """
+        partition = self._partitions.get(rank)
+        if partition is None:
+            target_ids = self.by_rank.get(rank, [])
+            partition = (target_ids, [self._requirement_row(target_id) for target_id in target_ids],
+                         [self._compile_program(self.characters[target_id]) for target_id in target_ids])
+            self._partitions[rank] = partition
+        return partition
+
+    def _select(self, ranks: tuple[Rank, ...]) -> None:
+        """
+        Make the targets of the given ranks the ones every query evaluates.
+
+        :param ranks: The result of target_ranks().
+        """
+        self.target_ranks = ranks
+        if len(ranks) == 1:
+            self.target_ids, self.requirements, self.programs = self.partition(ranks[0])
+        else:
+            # Targets of several ranks are merged in order of character ID, as if the whole roster were filtered
+            merged = sorted((entry for rank in ranks for entry in zip(*self.partition(rank))), key=lambda x: x[0])
+            self.target_ids = [target_id for target_id, _, _ in merged]
+            self.requirements = [requirement for _, requirement, _ in merged]
+            self.programs = [program for _, _, program in merged]
+        self.targets = [self.characters[target_id] for target_id in self.target_ids]
+
+    def __getstate__(self) -> dict:
+        """
+        Define what is pickled, such as for the workers of find_best_batch().
+
+        :return: The attributes, without the cache of views, which would pickle every other view too, nor the cache
+                 of evolutions, which holds a lock.
+        """
+        state = self.__dict__.copy()
+        state["_views"] = {}
+        state["_evolutions"] = None
+        return state
+
+    def get_state(self) -> tuple:
+        """
+        Get the compiled data as plain tuples, bytes and integers, which marshal can store.
+        Every partition built so far is included, by rank name. Recipe nodes are stored as (character ID, other) pairs.
+
+        :return: A tuple to give back to the constructor as its state.
+        """
+        partitions = {}
+        for rank, (_, requirements, programs) in self._partitions.items():
+            stored_programs = []
+            for nodes, node_ids, skips, amounts in programs:
+                node_refs = tuple((char_id, node.other) for char_id, node in zip(node_ids, nodes))
+                stored_programs.append((node_refs, node_ids.tobytes(), skips.tobytes(), amounts.tobytes()))
+            partitions[rank.name] = (tuple(row.tobytes() for row in requirements), tuple(stored_programs))
+        return tuple(self.order), partitions
+
+    def _set_state(self, state: tuple) -> None:
+        """
+        Load the compiled data from the result of get_state().
+
+        :param state: The tuple returned by get_state().
+        """
+        _, partitions = state
+        for rank_name, (requirements, stored_programs) in partitions.items():
+            programs = []
+            for node_refs, node_ids, skips, amounts in stored_programs:
+                nodes = []
+                for char_id, other in node_refs:
+                    char = self.characters[char_id]
+                    if other != char.other:
+                        char = Character(char.name, char.rank, char.materials, char.command, other)
+                    nodes.append(char)
+                programs.append((tuple(nodes), array("l", node_ids), array("l", skips), array("l", amounts)))
+            rank = Rank[rank_name]
+            self._partitions[rank] = (self.by_rank.get(rank, []), [array("l", row) for row in requirements], programs)
+
+    @property
+    def rows(self) -> list[tuple[tuple[int, int], ...]]:
+        """
+        For each character ID, the base materials of its flattened recipe as (column, units) pairs.
+        Built on first use in a single bottom-up pass: each row adds up the rows of the materials, which come first.
+        """
+        base = self._base
+        if base._rows is None:
+            rows = []
+            for char in self.characters:
+                units = {}
+                for material in char.materials:
+                    material_id = self.ids[material.name]
+                    column = self.columns[material_id]
+                    if column >= 0:
+                        units[column] = units.get(column, 0) + get_quantity(material)
+                    else:
+                        for material_column, needed in rows[material_id]:
+                            units[material_column] = units.get(material_column, 0) + needed
+                rows.append(tuple(sorted(units.items())))
+            base._rows = rows
+        return base._rows
+
+    def _requirement_row(self, char_id: int) -> array:
+        """
+        Get how many units of each base material the flattened recipe of a character needs.
+
+        :param char_id: The character ID.
+        :return: An array with one count per column.
+        """
+        row = array("l", [0] * len(self.materials))
+        for column, needed in self.rows[char_id]:
+            row[column] = needed
+        return row
+
+    def _compile_program(self, target: Character) -> tuple[tuple, array, array, array]:
+        """
+        Flatten the recipe tree of a target into pre-order arrays, with an explicit stack instead of recursion.
+        For each node, skips holds the position right after its subtree, so an owned node jumps over its materials.
+
+        :param target: The Character to compile.
+        :return: A tuple with the nodes, their character IDs, the skip positions and the units each node needs.
+        """
+        nodes = []
+        skips = []
+        stack = [(-1, iter(target.materials))]  # (position of the node, iterator over its materials)
+        while stack:
+            parent, sub_materials = stack[-1]
+            material = next(sub_materials, None)
+            if material is None:
+                stack.pop()
+                if parent >= 0:
+                    skips[parent] = len(nodes)  # The whole subtree of the node has been emitted
+                continue
+            position = len(nodes)
+            nodes.append(material)
+            skips.append(position + 1)
+            if material.rank not in BASE_RANKS and material.materials:
+                stack.append((position, iter(material.materials)))
+        node_ids = array("l", [self.ids[node.name] for node in nodes])
+        amounts = array("l", [get_quantity(node) for node in nodes])
+        return tuple(nodes), node_ids, array("l", skips), amounts
+
+    @property
+    def users(self) -> list[tuple[int, ...]]:
+        """
+        For each character ID, the IDs of the characters with it as a direct material, in ascending order.
+        Built on first use, with one pass over the recipes.
+        """
+        base = self._base
+        if base._users is None:
+            users = [[] for _ in base.characters]
+            for char_id, char in enumerate(base.characters):
+                for material in char.materials:
+                    users[base.ids[material.name]].append(char_id)
+            base._users = [tuple(sorted(set(user_ids))) for user_ids in users]
+        return base._users
+
+    def evolutions(self, char_id: int) -> tuple[int, ...]:
+        """
+        Get the IDs of every character that the given one can become, walking the users of each material in turn.
+        Only the queried characters are walked, so a large roster never holds the closure of every character, and
+        the latest results are kept.
+
+        :param char_id: The ID of the character.
+        :return: The IDs, sorted by rank in descending order, and by ID for the same rank.
+        """
+        base = self._base
+        if base._evolutions is None:
+            base._evolutions = QueryCache(EVOLUTION_QUERIES)
+        retorno = base._evolutions.get(char_id)
+        if retorno is None:
+            users = self.users
+            seen = set(users[char_id])
+            stack = list(seen)
+            while stack:
+                for user_id in users[stack.pop()]:
+                    if user_id not in seen:
+                        seen.add(user_id)
+                        stack.append(user_id)
+            char_ids = sorted(seen)
+            char_ids.sort(key=lambda evolution_id: base.characters[evolution_id].rank, reverse=True)  # Stable
+            retorno = tuple(char_ids)
+            base._evolutions.put(char_id, retorno)
+        return retorno
+
+    @instrument
+    def find_possible_evolutions(self, character: Character | str) -> list[Character]:
+        """
+        Get every character that can use the given one as a material, directly or indirectly.
+
+        :param character: The Character, or its name, to check as a potential material for others.
+        :return: A list of Character objects, sorted by rank in descending order. Empty if it is not in the roster.
+        """
+        char_id = self.ids.get(character if isinstance(character, str) else character.name)
+        if char_id is None:
+            return []
+        return [self.characters[evolution_id] for evolution_id in self.evolutions(char_id)]
+
+    def all_possible_evolutions(self) -> dict[str, list[Character]]:
+        """
+        Get the possible evolutions of every character in the roster at once.
+
+        :return: A dictionary from character name to the result of find_possible_evolutions().
+        """
+        return {name: self.find_possible_evolutions(name) for name in self.ids}
+
+    def column_of(self, name: str) -> int:
+        """
+        Get the requirement matrix column of a base material.
+
+        :param name: The name of the material.
+        :return: The column, or -1 if the name is not a base material of the roster.
+        """
+        char_id = self.ids.get(name)
+        return -1 if char_id is None else self.columns[char_id]
+
+    def encode(self, owned: Iterable[Character | str]) -> array:
+        """
+        Encode an owned inventory as a count vector indexed by character ID.
+        Numeric resources add their quantity, so Wood multiplied by 5 adds 5 units. A name adds one unit.
+        Items that are not in the roster are ignored, since no recipe can use them.
+
+        :param owned: A list of owned Character objects or names, or an Inventory.
+        :return: An array with how many units of each character are owned.
+        """
+        if isinstance(owned, Inventory):
+            if owned.ids is self.ids:
+                return array("l", owned.counts)  # Already encoded for this roster
+            owned = owned.to_list()
+        counts = array("l", [0] * len(self.characters))
+        for item in owned:
+            if isinstance(item, str):
+                char_id, amount = self.ids.get(item), 1
+            else:
+                char_id, amount = self.ids.get(item.name), get_quantity(item)
+            if char_id is not None:
+                counts[char_id] += amount
+        return counts
+
+    def material_counts(self, counts: array) -> array:
+        """
+        Keep only the base materials of an encoded inventory.
+
+        :param counts: A count vector from encode().
+        :return: An array with how many units of each base material are owned, one count per column.
+        """
+        return array("l", [counts[self.ids[material.name]] for material in self.materials])
+
+    def score(self, owned_materials: array) -> list[int]:
+        """
+        Count the missing base materials of every target at once.
+
+        :param owned_materials: A count vector from material_counts().
+        :return: A list with the number of missing units of each target, in the order of self.targets.
+        """
+        return [sum(needed - have for needed, have in zip(row, owned_materials) if needed > have)
+                for row in self.requirements]
+
+    def expanded_counts(self, counts: array) -> array:
+        """
+        Break every owned character down into the base materials of its recipe.
+        A recipe can never get more out of an owned character than its base materials, so scoring the expanded
+        inventory gives a lower bound of the missing units of every target.
+
+        :param counts: A count vector from encode().
+        :return: An array with one count per column.
+        """
+        expanded = array("l", [0] * len(self.materials))
+        columns = self.columns
+        for char_id, have in enumerate(counts):
+            if not have:
+                continue
+            if columns[char_id] >= 0:
+                expanded[columns[char_id]] += have
+            else:
+                for column, needed in self.rows[char_id]:
+                    expanded[column] += needed * have
+        return expanded
+
+    @instrument
+    def iter_best(self, owned: Iterable[Character | str], k: int | None = None,
+                  should_stop: Callable[[], bool] | None = None) -> Iterator[tuple[Character, list]]:
+        """
+        Yield the targets in the same order as find_best(), evaluating them only when needed.
+
+        Every target first gets a lower bound from the expanded inventory, which is a single pass over the
+        requirement matrix. Targets are then evaluated in order of their bound, and a target is yielded as soon as
+        no target left to evaluate can have a better bound, so the ones that cannot enter the top are never walked.
+
+        :param owned: A list of already owned Character objects or names.
+        :param k: The maximum number of targets to yield. None yields all of them.
+        :param should_stop: Called before each target is evaluated. Once it returns True, nothing more is evaluated
+                            or yielded, so a caller in another thread can cancel a query that is no longer needed.
+        :return: A generator of tuples, each containing a Character and a list of its missing common materials.
+        """
+        counts = self.encode(owned)
+        bounds = [(bound, i) for i, bound in enumerate(self.score(self.expanded_counts(counts)))]
+        heapq.heapify(bounds)
+        evaluated = []  # Heap of (missing units, target index, missing positions)
+        limit = len(self.targets) if k is None else min(k, len(self.targets))
+        for _ in range(limit):
+            while bounds and (not evaluated or bounds[0] < evaluated[0][:2]):
+                if should_stop is not None and should_stop():
+                    return
+                _, target_index = heapq.heappop(bounds)
+                missing = self._missing_positions(target_index, counts)
+                heapq.heappush(evaluated, (missing_units(missing), target_index, missing))
+            _, target_index, missing = heapq.heappop(evaluated)
+            yield self.targets[target_index], self.materialize_positions(target_index, missing)
+
+    def missing_commons(self, target_index: int, counts: array) -> list:
+        """
+        Determine which common materials a target still needs.
+        Owned intermediate characters are used, whole, as soon as the recipe asks for them, as in
+        Character.get_missing_commons, and numeric resources that are only partly owned are missing the difference.
+
+        :param target_index: The position of the target in self.targets.
+        :param counts: A count vector from encode(). It is not modified.
+        :return: A list of common materials that are still missing.
+        """
+        return self.materialize_positions(target_index, self._missing_positions(target_index, counts))
+
+    def _missing_positions(self, target_index: int, counts: array) -> list[tuple[int, int]]:
+        """
+        Walk the program of a target over an encoded inventory.
+
+        :param target_index: The position of the target in self.targets.
+        :param counts: A count vector from encode(). It is not modified.
+        :return: The (program position, missing units) pairs of the missing common materials.
+        """
+        remaining = array("l", counts)  # A cheap copy, in place of a deepcopy of the owned list
+        return self.allocate(target_index, remaining)[1]
+
+    def allocate(self, target_index: int, remaining: array) -> tuple[list[tuple[int, int]], list[tuple[int, int]]]:
+        """
+        Walk the program of a target over an encoded inventory, using up the owned characters it needs.
+        Owned characters are taken, whole, as soon as the recipe asks for them, as in Character.get_missing_commons.
+        Numeric resources are taken in units, and whatever the inventory has of them is used.
+
+        :param target_index: The position of the target in self.targets.
+        :param remaining: A count vector from encode(). The used units are subtracted from it.
+        :return: A tuple with the (program position, units) pairs of the used characters and of the missing
+                 common materials.
+        """
+        nodes, node_ids, skips, amounts = self.programs[target_index]
+        columns = self.columns  # Base materials are the characters with a column
+        used = []
+        missing = []
+        position = 0
+        end = len(nodes)
+        while position < end:
+            char_id = node_ids[position]
+            amount = amounts[position]
+            have = remaining[char_id]
+            if have >= amount:
+                remaining[char_id] -= amount  # Use the owned character and skip its materials
+                used.append((position, amount))
+                position = skips[position]
+            elif columns[char_id] >= 0:
+                if have > 0:
+                    remaining[char_id] = 0  # Partial credit for a numeric resource
+                    used.append((position, have))
+                missing.append((position, amount - have))
+                position += 1
+            else:
+                position += 1  # Look into the materials of the character
+        return used, missing
+
+    def _missing_leaf_positions(self, target_index: int, owned_materials: array) -> list[tuple[int, int]]:
+        """
+        Find the missing common materials of a target when only base materials are owned.
+        The first occurrences of each material in the recipe are the ones covered, as in the program walk.
+
+        :param target_index: The position of the target in self.targets.
+        :param owned_materials: A count vector from material_counts(). It is not modified.
+        :return: The (program position, missing units) pairs of the missing common materials.
+        """
+        nodes, node_ids, _, amounts = self.programs[target_index]
+        columns = self.columns
+        remaining = array("l", owned_materials)
+        retorno = []
+        for position, char_id in enumerate(node_ids):
+            if nodes[position].rank not in BASE_RANKS:
+                continue
+            column = columns[char_id]
+            amount = amounts[position]
+            have = min(amount, remaining[column])
+            if have:
+                remaining[column] -= have
+            if have < amount:
+                retorno.append((position, amount - have))
+        return retorno
+
+    def rank(self, counts: array) -> list[tuple[int, list[tuple[int, int]]]]:
+        """
+        Rank every target against an encoded inventory.
+
+        :param counts: A count vector from encode().
+        :return: A list of (target index, missing (program position, units) pairs) pairs, sorted by the number of
+                 missing units.
+        """
+        owned_materials = self.material_counts(counts)
+        if sum(owned_materials) == sum(counts):
+            # Only base materials are owned, so the requirement matrix gives the exact counts in a single pass
+            missing_counts = self.score(owned_materials)
+            order = sorted(range(len(self.targets)), key=missing_counts.__getitem__)
+            return [(i, self._missing_leaf_positions(i, owned_materials)) for i in order]
+
+        missings = [(i, self._missing_positions(i, counts)) for i in range(len(self.targets))]
+        return sorted(missings, key=lambda x: missing_units(x[1]))  # Sort the characters by the missing units
+
+    def missing_by_column(self, counts: array) -> list[array]:
+        """
+        Count the missing units of each base material for every target.
+        Base materials are always leaves of the programs, so one more unit of a base material only ever covers one
+        more of its missing units: these rows give the effect of any acquisition of base materials without walking
+        the programs again.
+
+        :param counts: A count vector from encode().
+        :return: One row per target, in the order of self.targets, with the missing units of each column.
+        """
+        owned_materials = self.material_counts(counts)
+        if sum(owned_materials) == sum(counts):
+            # Only base materials are owned, so the requirement matrix gives the rows in a single pass
+            return [array("l", [needed - have if needed > have else 0 for needed, have in zip(row, owned_materials)])
+                    for row in self.requirements]
+
+        columns = self.columns
+        retorno = []
+        for target_index in range(len(self.targets)):
+            node_ids = self.programs[target_index][1]
+            row = array("l", [0] * len(self.materials))
+            for position, units in self._missing_positions(target_index, counts):
+                row[columns[node_ids[position]]] += units
+            retorno.append(row)
+        return retorno
+
+    def materialize_positions(self, target_index: int, positions: list[tuple[int, int]]) -> list:
+        """
+        Turn (program position, units) pairs of a target, either used or missing, into Character objects.
+        A numeric resource with fewer units than the recipe asks for becomes a copy with that quantity.
+
+        :param target_index: The position of the target in self.targets.
+        :param positions: (program position, units) pairs, from allocate() or rank().
+        :return: A list of Character objects.
+        """
+        nodes = self.programs[target_index][0]
+        retorno = []
+        for position, amount in positions:
+            node = nodes[position]
+            if amount != get_quantity(node):
+                node = Character(node.name, node.rank, node.materials, node.command, amount)
+            retorno.append(node)
+        return retorno
+
+    def materialize(self, ranked: list[tuple[int, list[tuple[int, int]]]]) -> list[tuple[Character, list]]:
+        """
+        Turn the result of rank() into Character objects.
+
+        :param ranked: A list of (target index, missing (program position, units) pairs) pairs.
+        :return: A list of tuples, each containing a Character and a list of its missing common materials.
+        """
+        return [(self.targets[target_index], self.materialize_positions(target_index, positions))
+                for target_index, positions in ranked]
+
+    @instrument
+    def find_best(self, owned: Iterable[Character | str]) -> list[tuple[Character, list]]:
+        """
+        Evaluate every target against an owned inventory, with the same results as find_best_char_opt.
+
+        :param owned: A list of already owned Character objects or names.
+        :return: A sorted list of tuples, each containing a Character and a list of its missing common materials.
+        """
+        return self.materialize(self.rank(self.encode(owned)))
+
+    @instrument
+    def find_best_batch(self, inventories: Iterable[Iterable[Character | str]], max_workers: int | None = None,
+                        parallel_threshold: int = PARALLEL_THRESHOLD) -> list[list[tuple[Character, list]]]:
+        """
+        Evaluate many owned inventories at once.
+        Small batches are ranked in this process. Larger ones are split in chunks over a process pool, where each
+        worker receives the compiled roster once, when it starts, and the tasks only carry the encoded inventories.
+
+        :param inventories: The owned inventories, each a list of Character objects or names.
+        :param max_workers: The number of worker processes. Defaults to the number of CPUs.
+        :param parallel_threshold: The smallest batch that is sent to the process pool.
+        :return: One result of find_best() for each inventory, in the same order.
+        """
+        encoded = [self.encode(owned) for owned in inventories]
+        workers = max_workers or os.cpu_count() or 1
+        if len(encoded) < parallel_threshold or workers <= 1:
+            return [self.materialize(self.rank(counts)) for counts in encoded]
+
+        with self.worker_pool(workers) as executor:
+            ranked = self.rank_batch(encoded, executor, max(1, math.ceil(len(encoded) / (workers * 4))))
+        return [self.materialize(result) for result in ranked]
+
+    def worker_pool(self, max_workers: int | None = None):
+        """
+        Start a process pool whose workers receive this compiled roster once, when they start, for rank_batch().
+
+        :param max_workers: The number of worker processes. Defaults to the number of CPUs.
+        :return: A concurrent.futures.ProcessPoolExecutor, to be shut down by the caller.
+        """
+        from concurrent.futures import ProcessPoolExecutor  # Slow to import, and only needed for large batches
+
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(self,))
+
+    def rank_batch(self, encoded: list[array], executor=None, chunk_size: int = 64) -> list[list[tuple[int, list]]]:
+        """
+        Rank many encoded inventories, on a process pool from worker_pool() if one is given.
+        The tasks only carry the count vectors, in chunks.
+
+        :param encoded: Count vectors from encode().
+        :param executor: A pool from worker_pool() of this compiled roster, or None to rank in this process.
+        :param chunk_size: The number of inventories of each task sent to the pool.
+        :return: The result of rank() for each inventory, in the same order.
+        """
+        if executor is None:
+            return [self.rank(counts) for counts in encoded]
+        chunks = [encoded[i:i + chunk_size] for i in range(0, len(encoded), chunk_size)]
+        return [ranked for ranked_chunk in executor.map(_rank_chunk, chunks) for ranked in ranked_chunk]
+
+
+def target_ranks(target_rank: Rank | Iterable[Rank]) -> tuple[Rank, ...]:
+    """
+    Normalize the target ranks of a query.
+
+    :param target_rank: A Rank, or several of them.
+    :return: The distinct ranks, in ascending order.
+    :raises TypeError: If any of them is not a Rank.
+    :raises ValueError: If no rank is given.
+    """
+    ranks = (target_rank,) if isinstance(target_rank, Rank) else tuple(target_rank)
+    for rank in ranks:
+        if not isinstance(rank, Rank):
+            raise TypeError("Expected Rank but got " + str(type(rank)))
+    if not ranks:
+        raise ValueError("Expected at least one target rank")
+    return tuple(sorted(set(ranks)))
+
+
+def compile_order(characters: list[Character]) -> list[int]:
+    """
+    Validate a roster and sort it so that every character comes after its materials.
+
+    Every material must be a character of the roster, must have a lower rank than the character using it, and no
+    recipe can use itself, directly or indirectly. Characters keep their order in the list whenever it is valid.
+
+    :param characters: The Character objects of the roster.
+    :return: The positions of the characters in the list, in topological order.
+    :raises ValueError: Listing every unresolved name, rank inversion and cycle found.
+    """
+    positions = {}
+    for position, char in enumerate(characters):
+        positions.setdefault(char.name, position)
+
+    problems = []
+    users = [[] for _ in characters]  # Position -> positions of the characters using it, once per use
+    pending = [0] * len(characters)  # Position -> materials not yet placed in the order
+    for position, char in enumerate(characters):
+        for material in char.materials:
+            material_position = positions.get(material.name)
+            if material_position is None:
+                problems.append(f"{char.name} uses {material.name}, which is not in the roster")
+                continue
+            if material.rank >= char.rank:
+                problems.append(f"{char.name} ({char.rank.name}) uses {material.name} ({material.rank.name}), "
+                                f"which does not have a lower rank")
+            users[material_position].append(position)
+            pending[position] += 1
+
+    # Kahn's algorithm, always taking the first ready character in the list
+    ready = [position for position, count in enumerate(pending) if count == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        position = heapq.heappop(ready)
+        order.append(position)
+        for user in users[position]:
+            pending[user] -= 1
+            if pending[user] == 0:
+                heapq.heappush(ready, user)
+    if len(order) < len(characters):
+        in_cycle = [characters[position].name for position, count in enumerate(pending) if count > 0]
+        problems.append("Recipes that depend on themselves: " + ", ".join(in_cycle))
+
+    if problems:
+        raise ValueError("Invalid roster:\n" + "\n".join(problems))
+    return order
+
+
+# Compiled roster of a worker process, set once by _init_worker
+_worker_roster: CompiledRoster | None = None
+
+
+def _init_worker(compiled: CompiledRoster) -> None:
+    """
+    Keep the compiled roster in a worker process, so it is not sent again with every task.
+
+    :param compiled: The CompiledRoster to use in this process.
+    """
+    global _worker_roster
+    _worker_roster = compiled
+
+
+def _rank_chunk(chunk: list[array]) -> list[list[tuple[int, list[tuple[int, int]]]]]:
+    """
+    Rank a chunk of encoded inventories in a worker process.
+
+    :param chunk: Count vectors from CompiledRoster.encode().
+    :return: The result of CompiledRoster.rank() for each inventory.
+    """
+    return [_worker_roster.rank(counts) for counts in chunk]
+
+
+def missing_units(positions: list[tuple[int, int]]) -> int:
+    """
+    Count the missing units in (program position, units) pairs.
+
+    :param positions: (program position, units) pairs, from CompiledRoster.allocate() or CompiledRoster.rank().
+    :return: The total number of units.
+    """
+    return sum(amount for _, amount in positions)
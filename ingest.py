@@ -0,0 +1,364 @@
+import os
+import sys
+from array import array
+from typing import Iterable, Iterator
+
+from character import Rank, Roster
+from engine import CompiledRoster, missing_units
+from profiling import instrument
+from snapshot import DEFAULT_VERSION, get_roster
+
+# Inventory snapshots ranked together. Memory only depends on this, not on the size of the corpus
+DEFAULT_BATCH = 2048
+
+# Batches are only sent to a process pool from this size on
+PARALLEL_BATCH = 256
+
+# Distinct unknown names kept as examples in the statistics
+MAX_UNKNOWN_NAMES = 20
+
+# Line formats of a log. Every line is one event, and an optional "[timestamp]" before it is ignored:
+#   GAME <id>                          starts a new game with an empty inventory, as does every new file
+#   ADD <name> [xN]   or   + <name> [xN] adds N units of a character (1 by default)
+#   REMOVE <name> [xN] or  - <name> [xN] removes N units, never going below 0
+#   SAVE <name> [xN], <name> [xN], ...   replaces the inventory with a save-code dump
+# Amounts are written " xN", so "ADD Luffy x3" adds three Luffy while "ADD Luffy 3" adds one Luffy 3.
+# Blank lines and lines starting with # are skipped. Keywords are not case-sensitive
+ADD_KEYWORDS = ("ADD", "+")
+REMOVE_KEYWORDS = ("REMOVE", "-")
+
+
+class IngestStats:
+    """
+    A class to aggregate how close the players of a corpus of games were to each target.
+
+    Every event of a game gives one inventory snapshot, and each snapshot is ranked like find_best_char_opt: the
+    first target is the closest one. Only counters with one entry per target are kept, so the statistics take the
+    same memory however many games are read.
+    """
+
+    def __init__(self, compiled: CompiledRoster):
+        """
+        Initialize the IngestStats object, with every counter at zero.
+
+        :param compiled: The CompiledRoster the snapshots are ranked with.
+        """
+        self.targets = compiled.targets
+        self.files = 0
+        self.games = 0
+        self.lines = 0
+        self.snapshots = 0
+        self.skipped = 0  # Lines that are not an event
+        self.unknown = 0  # Events with a name that is not in the roster
+        self.unknown_names = []  # A few of those names, as examples
+        count = len(compiled.targets)
+        self.closest = [0] * count  # Snapshots in which each target was the closest one
+        self.final = [0] * count  # Games that ended with each target as the closest one
+        self.ready = [0] * count  # Games in which each target had nothing missing at some point
+        self.total_missing = [0] * count  # Missing units of each target, summed over the snapshots
+        self.fewest_missing = [None] * count  # Fewest missing units of each target in any snapshot
+
+    def add_ranked(self, ranked: list[tuple[int, list]], final: bool, ready: set[int]) -> None:
+        """
+        Count one ranked snapshot.
+
+        :param ranked: The result of CompiledRoster.rank() for the snapshot.
+        :param final: Whether it is the last snapshot of its game.
+        :param ready: The targets already counted as ready in this game, updated in place.
+        """
+        self.snapshots += 1
+        if not ranked:
+            return
+        self.closest[ranked[0][0]] += 1
+        if final:
+            self.final[ranked[0][0]] += 1
+        total_missing = self.total_missing
+        fewest_missing = self.fewest_missing
+        for target_index, positions in ranked:
+            units = missing_units(positions)
+            total_missing[target_index] += units
+            if fewest_missing[target_index] is None or units < fewest_missing[target_index]:
+                fewest_missing[target_index] = units
+            if not units and target_index not in ready:
+                ready.add(target_index)
+                self.ready[target_index] += 1
+
+    def add_unknown(self, name: str) -> None:
+        """
+        Count an event with a name that is not in the roster.
+
+        :param name: The unknown name.
+        """
+        self.unknown += 1
+        if len(self.unknown_names) < MAX_UNKNOWN_NAMES and name not in self.unknown_names:
+            self.unknown_names.append(name)
+
+    def to_dict(self, top: int | None = None) -> dict:
+        """
+        Get the statistics as plain values, such as for JSON.
+
+        :param top: How many targets to include, the most often closest first. All of them if None.
+        :return: A dictionary with the counters of the corpus and a "targets" list with one dictionary per target.
+        """
+        order = sorted(range(len(self.targets)), key=lambda i: (-self.closest[i], -self.final[i], i))
+        if top is not None:
+            order = order[:top]
+        return {"files": self.files, "games": self.games, "lines": self.lines, "snapshots": self.snapshots,
+                "skipped": self.skipped, "unknown": self.unknown, "unknown_names": list(self.unknown_names),
+                "targets": [{"name": self.targets[i].name, "closest": self.closest[i], "final": self.final[i],
+                             "ready": self.ready[i],
+                             "mean_missing": self.total_missing[i] / self.snapshots if self.snapshots else 0.0,
+                             "fewest_missing": self.fewest_missing[i]} for i in order]}
+
+    def report(self, top: int = 10) -> str:
+        """
+        Format the statistics for people.
+
+        :param top: How many targets to list, the most often closest first.
+        :return: The report, one line per target after a summary line.
+        """
+        stats = self.to_dict(top)
+        lines = [f"{stats['files']} files, {stats['games']} games, {stats['snapshots']} snapshots, "
+                 f"{stats['skipped']} skipped lines, {stats['unknown']} unknown names"]
+        for target in stats["targets"]:
+            lines.append(f"{target['name']}: closest in {target['closest']} snapshots, at the end of "
+                         f"{target['final']} games, ready in {target['ready']} games, "
+                         f"{target['mean_missing']:.1f} missing on average, {target['fewest_missing']} at best")
+        if stats["unknown_names"]:
+            lines.append("Unknown names: " + ", ".join(stats["unknown_names"]))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        """
+        Define the formal representation of the IngestStats.
+
+        :return: The counters of the corpus.
+        """
+        return f"IngestStats(games={self.games}, snapshots={self.snapshots}, unknown={self.unknown})"
+
+
+def iter_files(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Expand directories into the files they contain, recursively and in name order.
+
+    :param paths: Paths of files or directories.
+    :return: A generator of file paths.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, directories, file_names in os.walk(path):
+                directories.sort()
+                for file_name in sorted(file_names):
+                    yield os.path.join(directory, file_name)
+        else:
+            yield path
+
+
+def iter_lines(path: str) -> Iterator[str]:
+    """
+    Read a log one line at a time. Files ending in .gz are decompressed on the fly.
+
+    :param path: The path of the log.
+    :return: A generator of lines, without their line breaks.
+    """
+    if path.endswith(".gz"):
+        import gzip  # Only needed for compressed logs
+
+        source = gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    else:
+        source = open(path, encoding="utf-8", errors="replace")
+    with source:
+        for line in source:
+            yield line.rstrip("\r\n")
+
+
+def parse_event(line: str) -> tuple[str, str | list[tuple[str, int]]] | None:
+    """
+    Parse one line of a log.
+
+    :param line: The line.
+    :return: ("game", id), ("add", argument), ("remove", argument), ("save", [(name, units), ...]) or ("other", line)
+             if the line is not an event, or None if it is blank or a comment. Arguments are the name with an
+             optional amount, not checked against the roster yet.
+    """
+    line = line.strip()
+    if line.startswith("["):  # Timestamp
+        line = line.partition("]")[2].strip()
+    if not line or line.startswith("#"):
+        return None
+    keyword, _, argument = line.partition(" ")
+    keyword = keyword.upper()
+    argument = argument.strip()
+    if keyword == "GAME":
+        return "game", argument
+    if keyword == "SAVE":
+        items = []
+        for item in argument.split(","):
+            if item.strip():
+                items.append(_split_amount(item.strip()))
+        return "save", items
+    if argument and keyword in ADD_KEYWORDS:
+        return "add", argument
+    if argument and keyword in REMOVE_KEYWORDS:
+        return "remove", argument
+    return "other", line
+
+
+def _split_amount(argument: str) -> tuple[str, int]:
+    """
+    Split a name and an optional amount, written " xN" so it cannot be read as part of a name.
+
+    :param argument: The argument of the event, such as "Luffy x3".
+    :return: A tuple with the name and the amount.
+    """
+    name, _, amount = argument.rpartition(" ")
+    if name and amount[:1] in ("x", "X") and amount[1:].isdigit():
+        return name.strip(), int(amount[1:])
+    return argument, 1
+
+
+def iter_snapshots(compiled: CompiledRoster, paths: Iterable[str],
+                   stats: IngestStats) -> Iterator[tuple[array, bool]]:
+    """
+    Replay the events of every log and yield the inventory after each one.
+    The inventory of the current game is a single count vector, updated in place, and each snapshot is a copy of it.
+
+    :param compiled: The CompiledRoster whose character IDs index the snapshots.
+    :param paths: Paths of logs, or directories of logs.
+    :param stats: The IngestStats that counts files, games, lines and unknown names.
+    :return: A generator of (count vector, whether it is the last snapshot of its game) pairs.
+    """
+    ids = compiled.ids
+    for path in iter_files(paths):
+        stats.files += 1
+        counts = array("l", [0] * len(compiled.characters))
+        pending = None  # The latest snapshot, held back until it is known whether the game ends with it
+        for line in iter_lines(path):
+            stats.lines += 1
+            event = parse_event(line)
+            if event is None:
+                continue
+            kind, argument = event
+            if kind == "other":
+                stats.skipped += 1
+                continue
+            if kind == "game":
+                if pending is not None:
+                    yield pending, True
+                    stats.games += 1
+                    pending = None
+                counts = array("l", [0] * len(compiled.characters))
+                continue
+            if kind == "save":
+                counts = array("l", [0] * len(compiled.characters))
+                for name, amount in argument:
+                    char_id = ids.get(name)
+                    if char_id is None:
+                        stats.add_unknown(name)
+                    else:
+                        counts[char_id] += amount
+            else:
+                name, amount = _split_amount(argument)
+                char_id = ids.get(name)
+                if char_id is None:
+                    stats.add_unknown(name)
+                    continue
+                if kind == "add":
+                    counts[char_id] += amount
+                else:
+                    counts[char_id] = max(0, counts[char_id] - amount)
+            if pending is not None:
+                yield pending, False
+            pending = array("l", counts)
+        if pending is not None:
+            yield pending, True
+            stats.games += 1
+
+
+@instrument
+def ingest(paths: Iterable[str], roster: Roster | None = None, rank: Rank | Iterable[Rank] = Rank.LEGENDARY,
+           batch_size: int = DEFAULT_BATCH, max_workers: int | None = 1) -> IngestStats:
+    """
+    Read a corpus of game logs and save-code dumps, and aggregate which targets the players were closest to at each
+    point of each game. Logs are streamed line by line and snapshots are ranked in batches, so memory does not grow
+    with the size of the corpus.
+
+    :param paths: Paths of logs, or directories of logs. See ADD_KEYWORDS for the line formats.
+    :param roster: The Roster to map names with. Defaults to the shared roster.
+    :param rank: The rank, or ranks, of the targets.
+    :param batch_size: How many snapshots are ranked together.
+    :param max_workers: The number of worker processes that rank the batches. 1 ranks them in this process, and
+                        None uses every CPU.
+    :return: The aggregated IngestStats.
+    :raises ValueError: If the batch size is smaller than 1.
+    """
+    if batch_size < 1:
+        raise ValueError("Expected a batch size of at least 1, got " + str(batch_size))
+    compiled = (roster if roster is not None else get_roster()).compiled(rank)
+    stats = IngestStats(compiled)
+    workers = max_workers or os.cpu_count() or 1
+    executor = compiled.worker_pool(workers) if workers > 1 and batch_size >= PARALLEL_BATCH else None
+    chunk_size = max(1, batch_size // (workers * 4))
+    ready = set()  # Targets already counted as ready in the current game
+
+    def flush(batch: list[tuple[array, bool]]) -> None:
+        ranked = compiled.rank_batch([counts for counts, _ in batch], executor, chunk_size)
+        for result, (_, final) in zip(ranked, batch):
+            stats.add_ranked(result, final, ready)
+            if final:
+                ready.clear()
+
+    try:
+        batch = []
+        for snapshot in iter_snapshots(compiled, paths, stats):
+            batch.append(snapshot)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return stats
+
+
+def main() -> int:
+    """
+    Aggregate a corpus of logs from the command line.
+
+    :return: The exit code.
+    """
+    import argparse  # Only needed when run from the command line
+
+    parser = argparse.ArgumentParser(description="Aggregate which targets players were closest to in game logs")
+    parser.add_argument("paths", nargs="+", metavar="PATH", help="log files or directories of logs")
+    parser.add_argument("--map-version", default=DEFAULT_VERSION, metavar="NAME",
+                        help=f"map version of the roster ({DEFAULT_VERSION} by default)")
+    parser.add_argument("--ranks", nargs="+", default=["LEGENDARY"], choices=list(Rank.__members__),
+                        help="ranks of the targets")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="snapshots ranked together")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes, 0 for every CPU")
+    parser.add_argument("--top", type=int, default=10, help="targets to report")
+    parser.add_argument("--json", action="store_true", help="print the statistics as JSON")
+    args = parser.parse_args()
+
+    try:
+        roster = get_roster(args.map_version)
+        stats = ingest(args.paths, roster, [Rank[rank] for rank in args.ranks], args.batch, args.workers or None)
+    except (NameError, ValueError) as error:
+        parser.error(str(error))
+    except OSError as error:
+        print("Error: " + str(error), file=sys.stderr)
+        return 1
+    if args.json:
+        import json  # Only needed for JSON output
+
+        print(json.dumps(stats.to_dict(args.top)))
+    else:
+        print(stats.report(args.top))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
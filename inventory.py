@@ -0,0 +1,239 @@
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Iterable, Iterator
+
+# Entries kept by a QueryCache when no size is given
+DEFAULT_CACHE_SIZE = 1024
+
+
+class Inventory:
+    """
+    A class to represent an owned inventory as a fixed-length count vector, indexed by character ID.
+
+    Two inventories with the same counts are equal and hash the same, whatever the order of the owned characters, so
+    they can be de-duplicated and used as cache keys. Copying one is a single array copy instead of a deepcopy.
+    The counts must not change once the inventory is hashed: added() and removed() return new inventories.
+    """
+
+    def __init__(self, compiled, owned: Iterable = ()):
+        """
+        Initialize the Inventory object.
+
+        :param compiled: The CompiledRoster whose character IDs index the counts. Every view of it works the same.
+        :param owned: A list of already owned Character objects or names, or another Inventory.
+        """
+        self.ids = compiled.ids  # Shared by every view of the compiled roster, so it identifies the roster
+        self.characters = compiled.characters
+        self.counts = compiled.encode(owned)
+        self._hash = None
+
+    @classmethod
+    def from_counts(cls, compiled, counts: array) -> "Inventory":
+        """
+        Wrap an existing count vector, such as one from CompiledRoster.encode().
+
+        :param compiled: The CompiledRoster whose character IDs index the counts.
+        :param counts: The count vector. It is used as it is, not copied.
+        :return: A new Inventory.
+        """
+        inventory = cls.__new__(cls)
+        inventory.ids = compiled.ids
+        inventory.characters = compiled.characters
+        inventory.counts = counts
+        inventory._hash = None
+        return inventory
+
+    def count(self, character) -> int:
+        """
+        Get how many units of a character the inventory has.
+
+        :param character: The Character, or its name, to count.
+        :return: The number of owned units, 0 if it is not in the roster.
+        """
+        char_id = self.ids.get(character if isinstance(character, str) else character.name)
+        return 0 if char_id is None else self.counts[char_id]
+
+    def copy(self) -> "Inventory":
+        """
+        :return: A new Inventory with a copy of the counts.
+        """
+        inventory = Inventory.__new__(Inventory)
+        inventory.ids = self.ids
+        inventory.characters = self.characters
+        inventory.counts = array("l", self.counts)
+        inventory._hash = self._hash
+        return inventory
+
+    def added(self, character, amount: int = 1) -> "Inventory":
+        """
+        Get a new inventory with more units of a character.
+
+        :param character: The Character, or its name, to add.
+        :param amount: How many units to add.
+        :return: A new Inventory.
+        :raises NameError: If the character is not in the roster.
+        """
+        char_id = self.ids.get(character if isinstance(character, str) else character.name)
+        if char_id is None:
+            raise NameError("Character not found")
+        inventory = self.copy()
+        inventory.counts[char_id] += amount
+        inventory._hash = None
+        return inventory
+
+    def removed(self, character, amount: int = 1) -> "Inventory":
+        """
+        Get a new inventory with fewer units of a character.
+
+        :param character: The Character, or its name, to remove.
+        :param amount: How many units to remove.
+        :return: A new Inventory.
+        :raises NameError: If the character is not in the roster.
+        :raises ValueError: If the inventory does not have that many.
+        """
+        if self.count(character) < amount:
+            name = character if isinstance(character, str) else character.name
+            if name not in self.ids:
+                raise NameError("Character not found")
+            raise ValueError("Not enough " + name + " owned")
+        return self.added(character, -amount)
+
+    def to_list(self) -> list:
+        """
+        Turn the inventory back into a list of Character objects, as the other functions take it.
+        Numeric resources become a single copy with their total quantity.
+
+        :return: A list of Character objects.
+        """
+        from character import Character  # The character module depends on this one
+
+        retorno = []
+        for char, count in self:
+            if isinstance(char.other, int) and char.other > 0:  # A numeric resource, counted in units
+                if count != char.other:
+                    char = Character(char.name, char.rank, char.materials, char.command, count)
+                retorno.append(char)
+            else:
+                retorno += [char] * count
+        return retorno
+
+    def __iter__(self) -> Iterator[tuple]:
+        """
+        Iterate over the owned characters.
+
+        :return: An iterator of (Character, units) pairs, in order of character ID.
+        """
+        characters = self.characters
+        return ((characters[char_id], count) for char_id, count in enumerate(self.counts) if count)
+
+    def __len__(self):
+        """
+        :return: The total number of owned units.
+        """
+        return sum(self.counts)
+
+    def __hash__(self):
+        """
+        Hash the counts, once.
+
+        :return: The hash of the count vector.
+        """
+        if self._hash is None:
+            self._hash = hash(self.counts.tobytes())
+        return self._hash
+
+    def __eq__(self, other):
+        """
+        Compare two inventories of the same roster by their counts.
+
+        :param other: Another Inventory.
+        :return: True if they have the same units of every character.
+        """
+        if isinstance(other, Inventory):
+            return self.ids is other.ids and self.counts == other.counts
+        return NotImplemented
+
+    def __repr__(self):
+        """
+        Define the formal representation of the Inventory.
+
+        :return: The owned characters with their units.
+        """
+        return "Inventory({" + ", ".join(f"{char.name!r}: {count}" for char, count in self) + "})"
+
+
+class QueryCache:
+    """
+    A class to keep the results of the latest queries, dropping the least recently used ones beyond a maximum size.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE):
+        """
+        Initialize the QueryCache object, empty.
+
+        :param maxsize: The maximum number of results to keep. 0 disables the cache.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get a cached result and mark it as the most recently used one.
+
+        :param key: The hashable key of the query.
+        :param default: What to return if the result is not cached.
+        :return: The cached result, or the default.
+        """
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        """
+        Cache a result, dropping the least recently used one if the cache is full.
+
+        :param key: The hashable key of the query.
+        :param value: The result. It is kept as it is, so it must not be changed afterwards.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Drop every cached result. The statistics are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Get the hit and miss statistics.
+
+        :return: A dictionary with the hits, misses, hit rate, current size and maximum size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "size": len(self._entries), "maxsize": self.maxsize}
+
+    def __len__(self):
+        """
+        :return: The number of cached results.
+        """
+        return len(self._entries)
@@ -1,19 +1,35 @@
-from all_characters import setup
-from character import Rank, Character, find_char_in_list, find_best_char_opt, format_missing_char
+import sys
 
-all_characters = setup()
+from character import Rank, Character, find_char_in_list, iter_best_char_opt, format_missing_char
+import profiling
+from render import FORMATS, render
+from snapshot import DEFAULT_VERSION, format_diff, get_roster, get_store
 
 
-def see_all_chars() -> None:
+def __getattr__(name: str):
+    """
+    Load the roster the first time main.all_characters is used, instead of when main is imported.
+
+    :param name: The name of the missing module attribute.
+    :return: The Roster of all characters, for "all_characters".
+    :raises AttributeError: For any other name.
+    """
+    if name == "all_characters":
+        return get_roster()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def see_all_chars(fmt: str = "text", version: str = DEFAULT_VERSION) -> None:
     """
     Prints the representation of all characters along with their associated common materials.
 
-    This function iterates over the global list of `all_characters` and prints each character's
-    name and a summary of the common materials associated with that character.
+    The whole report is rendered from the precomputed bills of the shared roster and written to the standard output
+    in a few large writes, instead of one print per character.
+
+    :param fmt: The output format, one of render.FORMATS: "text" for people, "jsonl" or "csv" for other tools.
+    :param version: The name of the map version to print.
     """
-    for char in all_characters:
-        # Print the character's name and a list of all common materials they require.
-        print(f"{char.__repr__()} - {char.get_repr_all_commons()}\n")
+    render(get_roster(version), sys.stdout, fmt)
 
 
 def see_best_opt_chars(owned_: tuple) -> None:
@@ -26,18 +42,49 @@ def see_best_opt_chars(owned_: tuple) -> None:
 
     :param owned_: A tuple containing the characters (materials) the player currently owns.
     """
-    # Find the best character options based on owned materials.
-    results = find_best_char_opt(all_characters, list(owned_))
+    # Find the best character options based on owned materials, limited to the top 5 to avoid overwhelming the player.
+    # Only the characters that can make it to the top are evaluated.
+    results = iter_best_char_opt(get_roster(), list(owned_), k=5)
 
     # Iterate through the top results and print their details.
-    for i, result in enumerate(results):
+    for result in results:
         print(f"{result[0].__repr__()} - {format_missing_char(result[1])}\n")
-        if i > 3:
-            break  # Limit output to the top 4 characters to avoid overwhelming the player.
 
 
 if __name__ == '__main__':
-    print()
-    # owned = find_char_in_list(all_characters, "Luffy") * 3 + find_char_in_list(all_characters, "Chopper") * 3 + find_char_in_list(all_characters, "Buggy") * 5
-    # see_best_opt_chars(owned)
-    see_all_chars()
+    import argparse  # Only needed when run from the command line, so importing main stays fast
+
+    parser = argparse.ArgumentParser(description="ORD-Helper")
+    parser.add_argument("--format", choices=FORMATS, default="text", help="output format of the roster report")
+    parser.add_argument("--map-version", default=DEFAULT_VERSION, metavar="NAME",
+                        help=f"map version of the roster ({DEFAULT_VERSION} by default)")
+    parser.add_argument("--versions", action="store_true", help="list the available map versions and exit")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"), help="compare the recipes of two map versions")
+    parser.add_argument("--profile", nargs="?", const="profile.json", default=None, metavar="PATH",
+                        help="record call counts, wall times and allocations, and write them as JSON to PATH "
+                             "(profile.json by default)")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="also count allocated bytes with tracemalloc, implies --profile")
+    args = parser.parse_args()
+    if args.profile_memory and not args.profile:
+        args.profile = "profile.json"  # Counting memory is only useful in a profile
+    if args.profile:
+        profiling.enable(trace_memory=args.profile_memory)
+
+    try:
+        if args.versions:
+            print("\n".join(get_store().versions()))
+        elif args.diff:
+            print(format_diff(get_store().diff(*args.diff)))
+        else:
+            if args.format == "text":
+                print()
+            # owned = find_char_in_list(get_roster(), "Luffy") * 3 + find_char_in_list(get_roster(), "Chopper") * 3 + find_char_in_list(get_roster(), "Buggy") * 5
+            # see_best_opt_chars(owned)
+            see_all_chars(args.format, args.map_version)
+    except NameError as error:
+        parser.error(str(error))
+
+    if args.profile:
+        profiling.disable()
+        profiling.dump(args.profile)
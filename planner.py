@@ -0,0 +1,289 @@
+import time
+from array import array
+from typing import Iterable
+
+from character import BASE_RANKS, Character, Rank, as_roster, count_materials
+from engine import CompiledRoster, missing_units
+from profiling import instrument
+
+# What plan_targets() optimizes first: completed targets, or total missing common materials
+OBJECTIVES = ("completed", "missing")
+
+
+class Plan:
+    """
+    A class to represent a set of targets built from one owned inventory, where each owned character is used once.
+    """
+
+    def __init__(self, steps: list[tuple[Character, list, list]], complete: bool):
+        """
+        Initialize the Plan object.
+
+        :param steps: The chosen targets, in the order they take materials, each as a tuple with the target,
+                      the owned characters (including intermediate merges) it uses and its missing common materials.
+        :param complete: False if the time budget ran out before the whole search space was covered.
+        """
+        self.steps = steps
+        self.complete = complete
+
+    @property
+    def completed(self) -> int:
+        """
+        :return: The number of targets that can be built with nothing missing.
+        """
+        return sum(1 for _, _, missing in self.steps if not missing)
+
+    @property
+    def missing(self) -> int:
+        """
+        :return: The total number of missing common material units of all the targets.
+        """
+        return sum(quantity for _, _, missing in self.steps for _, quantity in count_materials(missing))
+
+    def __repr__(self):
+        """
+        Define the formal representation of the Plan.
+
+        :return: The chosen targets with their missing materials.
+        """
+        return f"Plan({[(target, missing) for target, _, missing in self.steps]!r})"
+
+
+@instrument
+def plan_targets(char_list: list[Character], owned: list[Character], max_targets: int = 3,
+                 objective: str = "completed", time_budget: float = 0.05,
+                 rank: Rank | Iterable[Rank] = Rank.LEGENDARY) -> Plan:
+    """
+    Choose the targets to build from one owned inventory, when the targets compete for the same materials.
+
+    Every target of the rank is tried in order of fewest missing materials, taking its materials from what the previous
+    targets left. Repeated states are skipped, and branches are cut when even their best case, in which each
+    remaining target keeps its current missing count, cannot beat the best plan found. The first plan found is
+    the greedy one, so a plan is always returned, even if the time budget runs out.
+
+    :param char_list: The list of potential Character objects to evaluate.
+    :param owned: A list of already owned Character objects.
+    :param max_targets: How many targets to choose.
+    :param objective: "completed" to build as many targets as possible, then have the fewest missing materials,
+                      or "missing" to have the fewest missing materials, then build as many targets as possible.
+    :param time_budget: The maximum search time, in seconds.
+    :param rank: The rank, or ranks, of the characters to evaluate.
+    :return: The best Plan found.
+    :raises ValueError: If the objective is not one of OBJECTIVES.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError("Expected objective in " + str(OBJECTIVES) + ", got " + str(objective))
+
+    roster = as_roster(char_list)
+    compiled = roster.compiled(rank)
+    depth_limit = min(max_targets, len(compiled.targets))
+    deadline = time.perf_counter() + time_budget
+
+    def key_of(completed: int, missing: int) -> tuple[int, int]:
+        # Smaller keys are better plans
+        return (-completed, missing) if objective == "completed" else (missing, -completed)
+
+    best_key = None
+    best_steps = []
+    seen = set()  # (remaining inventory, chosen targets) states already searched
+    timed_out = False
+
+    def search(remaining: array, chosen: set, steps: list, completed: int, missing: int) -> None:
+        nonlocal best_key, best_steps, timed_out
+        if len(steps) == depth_limit:
+            key = key_of(completed, missing)
+            if best_key is None or key < best_key:
+                best_key, best_steps = key, list(steps)
+            return
+        if best_key is not None and time.perf_counter() > deadline:
+            timed_out = True
+            return
+        state = (remaining.tobytes(), frozenset(chosen))
+        if state in seen:
+            return
+        seen.add(state)
+
+        candidates = []
+        for target_index in range(len(compiled.targets)):
+            if target_index not in chosen:
+                trial = array("l", remaining)
+                used, missing_positions = compiled.allocate(target_index, trial)
+                candidates.append((missing_units(missing_positions), target_index, trial, used, missing_positions))
+        candidates.sort(key=lambda x: (x[0], x[1]))
+
+        # Best case for this branch: the next targets are the cheapest ones, and nothing is taken from them
+        slots = depth_limit - len(steps)
+        optimistic = key_of(completed + min(slots, sum(1 for candidate in candidates if candidate[0] == 0)),
+                            missing + sum(candidate[0] for candidate in candidates[:slots]))
+        if best_key is not None and optimistic >= best_key:
+            return
+
+        for missing_count, target_index, trial, used, missing_positions in candidates:
+            chosen.add(target_index)
+            steps.append((target_index, used, missing_positions))
+            search(trial, chosen, steps, completed + (missing_count == 0), missing + missing_count)
+            steps.pop()
+            chosen.remove(target_index)
+            if timed_out:
+                return
+
+    search(compiled.encode(owned), set(), [], 0, 0)
+
+    retorno = [(compiled.targets[target_index],
+                compiled.materialize_positions(target_index, used),
+                compiled.materialize_positions(target_index, missing_positions))
+               for target_index, used, missing_positions in best_steps]
+    return Plan(retorno, not timed_out)
+
+
+class BuildStep:
+    """
+    A class to represent one merge of a build order: the materials it consumes and the command that does it.
+    """
+
+    def __init__(self, character: Character, materials: tuple):
+        """
+        Initialize the BuildStep object.
+
+        :param character: The Character the merge makes.
+        :param materials: The Character objects it consumes, with numeric resources as copies with their quantity.
+        """
+        self.character = character
+        self.materials = materials
+
+    @property
+    def command(self) -> str:
+        """
+        :return: The command of the character, or a description of the merge if it has none.
+        """
+        return self.character.command or "Merge " + self.character.name
+
+    def __repr__(self):
+        """
+        Define the formal representation of the BuildStep.
+
+        :return: The command with the materials it consumes.
+        """
+        return f"{self.command} {format_materials(self.materials)}"
+
+
+class BuildOrder:
+    """
+    A class to represent the ordered merges that turn an owned inventory into a target.
+    """
+
+    def __init__(self, target: Character, steps: list[BuildStep], used: list, missing: list):
+        """
+        Initialize the BuildOrder object.
+
+        :param target: The Character to build.
+        :param steps: The merges, in the order they must be done. The last one makes the target.
+        :param used: The owned characters the build consumes, including intermediates.
+        :param missing: The common materials to get before all the steps can be done.
+        """
+        self.target = target
+        self.steps = steps
+        self.used = used
+        self.missing = missing
+
+    def __repr__(self):
+        """
+        Define the formal representation of the BuildOrder.
+
+        :return: The target with its number of steps and missing materials.
+        """
+        return f"BuildOrder({self.target.name!r}, {len(self.steps)} steps, missing {format_materials(self.missing)})"
+
+
+def format_materials(chars: list[Character]) -> str:
+    """
+    Generate a formatted string with the names and counts of Character objects.
+
+    :param chars: A list of Character objects, potentially containing duplicates.
+    :return: A string in the format "[xN Name, xM Name, ...]", or "[]" if the list is empty.
+    """
+    return "[" + ", ".join("x" + str(count) + " " + name for name, count in count_materials(chars)) + "]"
+
+
+def _build_order(compiled: CompiledRoster, target_index: int, remaining: array) -> BuildOrder:
+    """
+    Build the merge order of one target from an encoded inventory.
+
+    The program walk takes every owned character, intermediates included, at the highest point of the recipe that
+    asks for it, so none of its materials are merged. Every other character it goes through is merged, after all
+    the merges inside its subtree.
+
+    :param compiled: The CompiledRoster with the target.
+    :param target_index: The position of the target in compiled.targets.
+    :param remaining: A count vector from encode(). The used units are subtracted from it.
+    :return: The BuildOrder of the target.
+    """
+    nodes, node_ids, skips, _ = compiled.programs[target_index]
+    columns = compiled.columns  # Base materials are the characters with a column, and are never merged
+    used, missing = compiled.allocate(target_index, remaining)
+    owned_positions = {position for position, _ in used}
+
+    merges = []  # Program positions to merge
+    position = 0
+    while position < len(nodes):
+        if position in owned_positions:
+            position = skips[position]  # Owned, so its materials are not needed
+            continue
+        if columns[node_ids[position]] < 0:
+            merges.append(position)
+        position += 1
+    # A subtree ends at its skip position, and nested subtrees ending at the same place are merged deepest first
+    merges.sort(key=lambda position: (skips[position], -position))
+
+    steps = []
+    for position in merges:
+        children = []
+        child = position + 1
+        while child < skips[position]:
+            children.append(nodes[child])
+            child = skips[child]
+        steps.append(BuildStep(nodes[position], tuple(children)))
+    target = compiled.targets[target_index]
+    steps.append(BuildStep(target, target.materials))
+    return BuildOrder(target, steps, compiled.materialize_positions(target_index, used),
+                      compiled.materialize_positions(target_index, missing))
+
+
+@instrument
+def build_order(char_list: list[Character], target: Character | str, owned: list[Character]) -> BuildOrder:
+    """
+    Generate the ordered merges and commands to build one character from an owned inventory.
+    Owned intermediates are reused, so only the merges that are still needed are listed.
+
+    :param char_list: The list of all Character objects.
+    :param target: The Character, or its name, to build. It can be of any rank above the base ones.
+    :param owned: A list of already owned Character objects.
+    :return: The BuildOrder of the target.
+    :raises NameError: If the target is not in the roster.
+    :raises ValueError: If the target is a base material, which is never merged.
+    """
+    roster = as_roster(char_list)
+    target = roster.get(target if isinstance(target, str) else target.name)
+    if target.rank in BASE_RANKS:
+        raise ValueError(target.name + " is a base material and is not merged")
+    compiled = roster.compiled(target.rank)  # The partition of the target's rank has its program
+    target_index = compiled.target_ids.index(compiled.ids[target.name])
+    return _build_order(compiled, target_index, compiled.encode(owned))
+
+
+@instrument
+def build_orders(char_list: list[Character], owned: list[Character],
+                 rank: Rank | Iterable[Rank] = Rank.LEGENDARY) -> list[BuildOrder]:
+    """
+    Generate the build order of every target at once, each from the whole owned inventory.
+    The inventory is encoded once and every target reuses its compiled program.
+
+    :param char_list: The list of all Character objects.
+    :param owned: A list of already owned Character objects.
+    :param rank: The rank, or ranks, of the targets.
+    :return: One BuildOrder per target, in the order of compiled.targets.
+    """
+    roster = as_roster(char_list)
+    compiled = roster.compiled(rank)
+    counts = compiled.encode(owned)
+    return [_build_order(compiled, target_index, array("l", counts)) for target_index in range(len(compiled.targets))]
@@ -0,0 +1,215 @@
+import functools
+import sys
+import threading
+import time
+import tracemalloc
+
+# Flag of generator functions in their code object, the same as inspect.CO_GENERATOR, without importing inspect
+_CO_GENERATOR = 0x20
+
+# Upper bounds of the wall-time histogram buckets, in microseconds. Slower calls go to a last, unbounded bucket
+HISTOGRAM_BOUNDS_US = (10, 100, 1000, 10000, 100000, 1000000)
+
+_enabled = False  # Checked by every instrumented call, so a disabled call only pays for this lookup
+_trace_memory = False
+_started_tracing = False  # True if enable() started tracemalloc, so disable() stops it
+_stats = {}  # Function name -> Stats, filled while enabled
+_stats_lock = threading.Lock()
+
+
+class Stats:
+    """
+    A class to accumulate the calls of one instrumented function.
+    """
+
+    def __init__(self):
+        """
+        Initialize the Stats object with no calls.
+        """
+        self.calls = 0
+        self.total = 0.0  # Seconds
+        self.max = 0.0  # Seconds
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS_US) + 1)
+        self.blocks = 0  # Net memory blocks allocated by the calls
+        self.bytes = 0  # Net traced bytes allocated by the calls, only while tracing memory
+
+    def add(self, elapsed: float, blocks: int, allocated: int) -> None:
+        """
+        Record one call.
+
+        :param elapsed: The wall time of the call, in seconds.
+        :param blocks: The net memory blocks it allocated.
+        :param allocated: The net traced bytes it allocated.
+        """
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        elapsed_us = elapsed * 1e6
+        bucket = 0
+        while bucket < len(HISTOGRAM_BOUNDS_US) and elapsed_us > HISTOGRAM_BOUNDS_US[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+        self.blocks += blocks
+        self.bytes += allocated
+
+    def to_dict(self) -> dict:
+        """
+        Convert the Stats into plain values that JSON can store.
+
+        :return: A dictionary with the counters, the times in milliseconds and the histogram by bucket.
+        """
+        labels = [f"<={bound}us" for bound in HISTOGRAM_BOUNDS_US] + [f">{HISTOGRAM_BOUNDS_US[-1]}us"]
+        retorno = {"calls": self.calls, "total_ms": self.total * 1000, "mean_ms": self.total * 1000 / self.calls,
+                   "max_ms": self.max * 1000, "histogram": dict(zip(labels, self.histogram)),
+                   "blocks": self.blocks}
+        if _trace_memory:
+            retorno["bytes"] = self.bytes
+        return retorno
+
+
+def enable(trace_memory: bool = False) -> None:
+    """
+    Start recording the instrumented functions.
+
+    :param trace_memory: Also count the allocated bytes with tracemalloc, which slows every allocation down.
+    """
+    global _enabled, _trace_memory, _started_tracing
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+    _enabled = True
+
+
+def disable() -> None:
+    """
+    Stop recording the instrumented functions. What was recorded is kept until reset().
+    """
+    global _enabled, _started_tracing
+    _enabled = False
+    if _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+
+
+def is_enabled() -> bool:
+    """
+    :return: True if the instrumented functions are being recorded.
+    """
+    return _enabled
+
+
+def reset() -> None:
+    """
+    Forget every recorded call.
+    """
+    with _stats_lock:
+        _stats.clear()
+
+
+def report() -> dict[str, dict]:
+    """
+    Get what was recorded so far.
+
+    :return: The result of Stats.to_dict() by function name, slowest total first.
+    """
+    with _stats_lock:
+        ordered = sorted(_stats.items(), key=lambda item: item[1].total, reverse=True)
+        return {name: stats.to_dict() for name, stats in ordered}
+
+
+def dump(path: str) -> None:
+    """
+    Write the report as JSON.
+
+    :param path: The file to write.
+    """
+    import json  # Only needed when a report is written
+
+    with open(path, "w") as output:
+        json.dump(report(), output, indent=2)
+
+
+def _memory() -> tuple[int, int]:
+    """
+    :return: The allocated memory blocks and, while tracing memory, the traced bytes.
+    """
+    return sys.getallocatedblocks(), tracemalloc.get_traced_memory()[0] if _trace_memory else 0
+
+
+def _record(name: str, elapsed: float, before: tuple[int, int], after: tuple[int, int]) -> None:
+    """
+    Add one call to the Stats of a function.
+
+    :param name: The function name.
+    :param elapsed: The wall time of the call, in seconds.
+    :param before: The result of _memory() before the call.
+    :param after: The result of _memory() after the call.
+    """
+    with _stats_lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = Stats()
+        stats.add(elapsed, after[0] - before[0], after[1] - before[1])
+
+
+def instrument(function):
+    """
+    Decorate a public function so its calls are recorded while profiling is enabled.
+    Calls to generator functions are recorded once the generator is exhausted or closed, and only count the time
+    spent producing its items.
+
+    :param function: The function to instrument.
+    :return: The wrapped function.
+    """
+    name = function.__module__ + "." + function.__qualname__
+
+    if function.__code__.co_flags & _CO_GENERATOR:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            return _record_iteration(name, function(*args, **kwargs))
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            before = _memory()
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                _record(name, elapsed, before, _memory())
+    return wrapper
+
+
+def _record_iteration(name: str, iterator):
+    """
+    Go through a generator, adding up the time and memory of each item, and record them as one call at the end.
+
+    :param name: The function name.
+    :param iterator: The generator returned by the instrumented function.
+    :return: A generator with the same items.
+    """
+    elapsed = 0.0
+    blocks = 0
+    allocated = 0
+    try:
+        while True:
+            before = _memory()
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+                after = _memory()
+                blocks += after[0] - before[0]
+                allocated += after[1] - before[1]
+            yield item
+    finally:
+        iterator.close()
+        _record(name, elapsed, (0, 0), (blocks, allocated))
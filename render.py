@@ -0,0 +1,93 @@
+import io
+from typing import Iterable, Iterator, TextIO
+
+from character import Character, count_materials, format_bill
+from profiling import instrument
+
+# Output formats of render()
+FORMATS = ("text", "jsonl", "csv")
+
+# Columns of the CSV output. Materials and bills are "Name:quantity" pairs separated by "|"
+CSV_COLUMNS = ("name", "rank", "command", "materials", "bill")
+
+# Lines joined into each write, so a large roster is streamed in a few big writes instead of one per character
+CHUNK_LINES = 1024
+
+
+def _join_pairs(pairs: Iterable[tuple[str, int]]) -> str:
+    """
+    Join (name, quantity) pairs for one CSV cell.
+
+    :param pairs: The (name, quantity) pairs, such as the ones in Character.bill.
+    :return: A string in the format "Name:N|Name:M".
+    """
+    return "|".join(name + ":" + str(quantity) for name, quantity in pairs)
+
+
+def iter_lines(characters: Iterable[Character], fmt: str = "text") -> Iterator[str]:
+    """
+    Generate the roster report one line at a time, from the precomputed bills of the characters.
+
+    The text format is the one of main.see_all_chars(). JSON Lines has one object per character with its name,
+    rank, command, direct materials and bill, the last two as {name: quantity} objects in order of first use.
+    CSV starts with a header row of CSV_COLUMNS.
+
+    :param characters: The Character objects to render, such as a Roster.
+    :param fmt: One of FORMATS.
+    :return: A generator of lines, each ending with a newline.
+    :raises ValueError: If the format is not one of FORMATS.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Expected format in " + str(FORMATS) + ", got " + str(fmt))
+
+    if fmt == "text":
+        for char in characters:
+            yield f"{char!r} - {format_bill(char.bill)}\n\n"
+
+    elif fmt == "jsonl":
+        import json  # Only needed for this format
+
+        for char in characters:
+            yield json.dumps({"name": char.name, "rank": char.rank.name, "command": char.command,
+                              "materials": dict(count_materials(char.materials)),
+                              "bill": dict(char.bill)}, ensure_ascii=False) + "\n"
+
+    else:
+        import csv  # Only needed for this format
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(CSV_COLUMNS)
+        for char in characters:
+            writer.writerow((char.name, char.rank.name, char.command, _join_pairs(count_materials(char.materials)),
+                             _join_pairs(char.bill)))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()  # The header of an empty roster
+
+
+@instrument
+def render(characters: Iterable[Character], output: TextIO | None = None, fmt: str = "text") -> str | None:
+    """
+    Render the roster report, writing it in chunks of CHUNK_LINES lines.
+
+    :param characters: The Character objects to render, such as a Roster.
+    :param output: The file to write to, or None to return the report as a string.
+    :param fmt: One of FORMATS.
+    :return: The report if no output is given, otherwise None.
+    :raises ValueError: If the format is not one of FORMATS.
+    """
+    if output is None:
+        return "".join(iter_lines(characters, fmt))
+
+    chunk = []
+    for line in iter_lines(characters, fmt):
+        chunk.append(line)
+        if len(chunk) == CHUNK_LINES:
+            output.write("".join(chunk))
+            chunk.clear()
+    if chunk:
+        output.write("".join(chunk))
+    return None
@@ -0,0 +1,249 @@
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import TextIO
+
+from character import Character, Roster, format_bill, format_missing_char
+from snapshot import get_roster
+from whatif import what_if
+
+HELP = """Commands:
+  add NAME [xN]      add N of a character to the inventory (1 by default), such as add Luffy x3
+  remove NAME [xN]   remove N of a character from the inventory
+  clear              empty the inventory
+  owned              show the inventory
+  top                show the best options for the inventory
+  next [ROLLS]       show which common of the next roll helps most, looking ROLLS rolls ahead (1 to 3)
+  bill NAME          show the common materials of a character
+  evolutions NAME    show what a character can become
+  help               show this message
+  quit               leave
+Names are not case-sensitive."""
+
+
+class Repl:
+    """
+    A class to run an interactive prompt where the player edits an inventory and asks for the best options.
+
+    The best options are recomputed in an executor after every edit, so the prompt never waits for them. Each edit
+    starts a new generation: the recomputation of an older generation is cancelled, and if it is already running it
+    stops before it evaluates its next target, so the options shown always match the latest inventory.
+    """
+
+    def __init__(self, roster: Roster, k: int = 5, output: TextIO = sys.stdout):
+        """
+        Initialize the Repl object with an empty inventory.
+
+        :param roster: The Roster to query.
+        :param k: How many of the best options to show.
+        :param output: Where to write the answers.
+        """
+        self.roster = roster
+        self.compiled = roster.compiled()
+        self.k = k
+        self.output = output
+        self.owned = []  # Names of the owned characters, with repetitions
+        self.top = []  # Best options of the latest finished generation
+        self._names = {}  # Lowercase name -> name
+        for char in roster:
+            self._names.setdefault(char.name.lower(), char.name)
+        self._generation = 0
+        self._task = None  # Recomputation of the latest generation
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def handle(self, line: str) -> bool:
+        """
+        Run one command.
+
+        :param line: The command, as typed.
+        :return: False if the command was quit, otherwise True.
+        """
+        command, _, argument = line.strip().partition(" ")
+        command = command.lower()
+        argument = argument.strip()
+        try:
+            if command in ("quit", "exit"):
+                return False
+            elif command == "add":
+                name, amount = self._parse_amount(argument)
+                self.owned += [name] * amount
+                self._schedule()
+            elif command == "remove":
+                name, amount = self._parse_amount(argument)
+                if self.owned.count(name) < amount:
+                    raise ValueError("Not enough " + name + " owned")
+                for _ in range(amount):
+                    self.owned.remove(name)
+                self._schedule()
+            elif command == "clear":
+                self.owned = []
+                self._schedule()
+            elif command == "owned":
+                self._print(format_missing_char([self.roster.get(name) for name in self.owned]) if self.owned else "[]")
+            elif command == "top":
+                await self.wait()
+                self._print_top()
+            elif command == "next":
+                self._print_next(argument)
+            elif command == "bill":
+                self._print(format_bill(self.roster.get(self._resolve(argument)).bill))
+            elif command == "evolutions":
+                evolutions = self.compiled.find_possible_evolutions(self._resolve(argument))
+                self._print(", ".join(char.name for char in evolutions) or "None")
+            elif command in ("help", "?"):
+                self._print(HELP)
+            elif command:
+                raise ValueError("Unknown command " + command + ", type help to see the commands")
+        except (NameError, ValueError) as error:
+            self._print("Error: " + str(error))
+        return True
+
+    async def wait(self) -> None:
+        """
+        Wait until the best options match the latest inventory.
+        """
+        if self._task is None:
+            self._schedule()  # Nothing was edited yet, so the options of the empty inventory are still missing
+        while self._task is not None and not self._task.done():
+            task = self._task
+            try:
+                await task
+            except asyncio.CancelledError:
+                if task is self._task:
+                    raise  # The wait itself was cancelled, not just a stale recomputation
+
+    async def run(self, input_stream: TextIO = sys.stdin) -> None:
+        """
+        Read and run commands until quit or the end of the input.
+        Lines are read in a separate thread, so recomputations go on while the player types.
+
+        :param input_stream: Where to read the commands from.
+        """
+        loop = asyncio.get_running_loop()
+        self._print('ORD-Helper. Type "help" to see the commands.')
+        try:
+            while True:
+                self.output.write("> ")
+                self.output.flush()
+                line = await loop.run_in_executor(None, input_stream.readline)
+                if not line or not await self.handle(line):
+                    break
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Cancel any pending recomputation and stop the executor.
+        """
+        self._generation += 1
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _schedule(self) -> None:
+        """
+        Start recomputing the best options for the current inventory, cancelling the previous recomputation.
+        """
+        self._generation += 1
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = asyncio.get_running_loop().create_task(self._recompute(self._generation, list(self.owned)))
+
+    async def _recompute(self, generation: int, owned: list[str]) -> None:
+        """
+        Compute the best options in the executor and keep them if no newer edit happened meanwhile.
+
+        :param generation: The generation of the inventory.
+        :param owned: A copy of the inventory of that generation.
+        """
+        loop = asyncio.get_running_loop()
+        top = await loop.run_in_executor(self._executor, self._evaluate, generation, owned)
+        if top is not None and generation == self._generation:
+            self.top = top
+
+    def _evaluate(self, generation: int, owned: list[str]) -> list[tuple[Character, list]] | None:
+        """
+        Find the best options, giving up as soon as a newer generation starts. Runs in the executor.
+
+        :param generation: The generation of the inventory.
+        :param owned: The inventory of that generation.
+        :return: The best options, or None if the generation became stale.
+        """
+        retorno = list(self.compiled.iter_best(owned, self.k, lambda: generation != self._generation))
+        return retorno if generation == self._generation else None
+
+    def _resolve(self, name: str) -> str:
+        """
+        Find the name of a character, ignoring case.
+
+        :param name: The name as typed.
+        :return: The name in the roster.
+        :raises NameError: If the character is not in the roster.
+        """
+        resolved = self._names.get(name.lower())
+        if resolved is None:
+            raise NameError("Character not found: " + name)
+        return resolved
+
+    def _parse_amount(self, argument: str) -> tuple[str, int]:
+        """
+        Split a name and an optional amount, written " xN" so it cannot be read as part of a name: "Luffy x3" is three
+        Luffy, while "Luffy 3" is one Luffy 3.
+
+        :param argument: The argument as typed, such as "Luffy x3".
+        :return: A tuple with the name in the roster and the amount.
+        :raises NameError: If the character is not in the roster.
+        :raises ValueError: If the amount is not a positive integer.
+        """
+        name, _, amount = argument.rpartition(" ")
+        if not name or amount[:1] not in ("x", "X") or not amount[1:].isdigit():
+            return self._resolve(argument), 1
+        if int(amount[1:]) < 1:
+            raise ValueError("Expected a positive amount, got " + amount[1:])
+        return self._resolve(name.strip()), int(amount[1:])
+
+    def _print_top(self) -> None:
+        """
+        Print the best options of the latest generation, as main.see_best_opt_chars does.
+        """
+        for target, missing in self.top:
+            self._print(f"{target!r} - {format_missing_char(missing)}")
+
+    def _print_next(self, argument: str) -> None:
+        """
+        Print the commons that would help the current inventory most, as what_if() ranks them.
+
+        :param argument: The lookahead in rolls, as typed. Empty means 1.
+        :raises ValueError: If the lookahead is not between 1 and 3.
+        """
+        rolls = int(argument) if argument.isdigit() else 1 if not argument else 0
+        if not 1 <= rolls <= 3:
+            raise ValueError("Expected 1 to 3 rolls, got " + argument)
+        for value in what_if(self.roster, self.owned, lookahead=rolls)[:self.k]:
+            line = f"{value.candidate!r} - best option {value.best} missing, helps {value.improved} targets"
+            if rolls > 1:
+                line += f", {value.expected_best:.2f} missing expected after {rolls} rolls"
+            self._print(line)
+
+    def _print(self, text: str) -> None:
+        """
+        Write one answer.
+
+        :param text: The answer.
+        """
+        self.output.write(text + "\n")
+
+
+def main() -> None:
+    """
+    Start the interactive prompt with the shared roster.
+    """
+    repl = Repl(get_roster())
+    try:
+        asyncio.run(repl.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+
+from character import Rank, Roster, count_materials, find_best_char_opt
+from snapshot import DEFAULT_VERSION, available_versions, get_roster
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 47620
+
+# Operations of the protocol: each request is one JSON object per line, with "op" and the arguments of the operation,
+# and an optional "id" that is returned with the response. Responses come back in the order of the requests, so a
+# client can pipeline many requests before reading
+OPERATIONS = ("best", "evolutions", "bill", "ping")
+
+# Longest accepted request line, in bytes
+MAX_LINE = 1 << 20
+
+
+def answer(roster: Roster, request: dict, versions: dict[str, Roster] | None = None) -> dict:
+    """
+    Answer one request of the protocol.
+
+    "best" takes "owned", a list of names, an optional "k" (5 by default) and optional "ranks", a list of rank names
+    (["LEGENDARY"] by default), and returns the best options as {"name", "missing"} objects, where missing is a
+    {name: quantity} object. "evolutions" and "bill" take "name" and return a list of names and a {name: quantity}
+    object. "ping" returns "pong". Every operation takes an optional "version", the name of a map version, to query
+    that roster instead of the served one.
+
+    :param roster: The Roster to query.
+    :param request: The decoded request.
+    :param versions: The rosters of the map versions a request can ask for, from load_versions(). If None, a
+                     requested version is loaded the first time it is asked for.
+    :return: The response, with "ok" and either "result" or "error".
+    """
+    response = {"id": request.get("id")} if isinstance(request, dict) else {"id": None}
+    try:
+        if not isinstance(request, dict):
+            raise TypeError("Expected a JSON object, got " + type(request).__name__)
+        op = request.get("op")
+        version = request.get("version")
+        if version is not None:
+            if not isinstance(version, str):
+                raise TypeError("Expected version to be a string")
+            if versions is None:
+                roster = version_roster(roster, version)
+            else:
+                roster = versions.get(version)  # Loaded before serving, so a request never waits for a load
+                if roster is None:
+                    raise NameError("Version not found: " + version)
+        if op == "best":
+            owned = request.get("owned", [])
+            k = request.get("k", 5)
+            ranks = request.get("ranks", ["LEGENDARY"])
+            if not isinstance(owned, list) or not all(isinstance(name, str) for name in owned):
+                raise TypeError("Expected owned to be a list of names")
+            if not isinstance(k, int) or k < 0:
+                raise ValueError("Expected k to be a non-negative integer, got " + str(k))
+            if not isinstance(ranks, list) or not all(rank in Rank.__members__ for rank in ranks):
+                raise ValueError("Expected ranks to be a list of rank names, got " + str(ranks))
+            for name in owned:
+                roster.get(name)  # Unknown names are an error, not an empty slot
+            target_ranks = [Rank[rank] for rank in ranks]
+            if roster.persistent is not None:
+                # Ranked in full once, so the same inventory comes from the caches, even after a restart
+                best = find_best_char_opt(roster, owned, target_ranks)[:k]
+            else:
+                best = roster.compiled(target_ranks).iter_best(owned, k)  # Only evaluates the targets of the top k
+            result = [{"name": target.name, "missing": dict(count_materials(missing))} for target, missing in best]
+        elif op == "evolutions":
+            result = [char.name for char in roster.compiled().find_possible_evolutions(_name_of(roster, request))]
+        elif op == "bill":
+            result = dict(roster.get(_name_of(roster, request)).bill)
+        elif op == "ping":
+            result = "pong"
+        else:
+            raise ValueError("Expected op in " + str(OPERATIONS) + ", got " + str(op))
+    except (NameError, TypeError, ValueError) as error:
+        response["ok"] = False
+        response["error"] = str(error)
+        return response
+    response["ok"] = True
+    response["result"] = result
+    return response
+
+
+def version_roster(roster: Roster, version: str) -> Roster:
+    """
+    Get the roster of a map version, with the same persistent cache as the served roster. Stored results are keyed
+    by roster version, so the versions can share one cache.
+
+    :param roster: The served Roster.
+    :param version: The name of the map version.
+    :return: The Roster of the version.
+    :raises NameError: If the version has no roster module.
+    """
+    retorno = get_roster(version)
+    if retorno.persistent is None:
+        retorno.persistent = roster.persistent
+    return retorno
+
+
+def load_versions(roster: Roster) -> dict[str, Roster]:
+    """
+    Load and compile the roster of every map version, so requests for any of them are answered without a load.
+
+    :param roster: The served Roster.
+    :return: A dictionary from version name to Roster.
+    """
+    retorno = {}
+    for version in available_versions():
+        retorno[version] = version_roster(roster, version)
+        retorno[version].compiled().users  # Built on first use, so it is built here and not during the first query
+    return retorno
+
+
+def _name_of(roster: Roster, request: dict) -> str:
+    """
+    Get the character name of a request.
+
+    :param roster: The Roster to look the name up in.
+    :param request: The decoded request.
+    :return: The name.
+    :raises TypeError: If the request has no name.
+    :raises NameError: If the character is not in the roster.
+    """
+    name = request.get("name")
+    if not isinstance(name, str):
+        raise TypeError("Expected name to be a string")
+    roster.get(name)
+    return name
+
+
+async def _handle_client(roster: Roster, versions: dict[str, Roster], reader: asyncio.StreamReader,
+                         writer: asyncio.StreamWriter) -> None:
+    """
+    Answer the requests of one client until it disconnects.
+
+    :param roster: The Roster to query.
+    :param versions: The rosters of the map versions, from load_versions().
+    :param reader: The stream of the client's requests.
+    :param writer: The stream of the responses.
+    """
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                writer.write(b'{"id": null, "ok": false, "error": "Request too long"}\n')
+                break
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                response = answer(roster, json.loads(line), versions)
+            except ValueError as error:  # Invalid JSON
+                response = {"id": None, "ok": False, "error": "Invalid JSON: " + str(error)}
+            writer.write(json.dumps(response).encode() + b"\n")
+            # Only waits when the client stops reading, so pipelined requests are answered back to back
+            await writer.drain()
+    except ConnectionError:
+        pass  # The client went away, so there is nobody to answer
+    finally:
+        writer.close()
+
+
+async def serve(roster: Roster, socket_path: str | None = None, host: str = DEFAULT_HOST,
+                port: int = DEFAULT_PORT, ready: asyncio.Event | None = None) -> None:
+    """
+    Serve the protocol until cancelled, on a Unix socket or on a local TCP port.
+    Clients are served concurrently, each one on its own connection.
+
+    :param roster: The Roster to query. Its compiled form, and the rosters of every map version, are built before
+                   the first client is accepted, away from the event loop.
+    :param socket_path: The path of the Unix socket, or None to listen on host and port.
+    :param host: The address to listen on, when no socket path is given.
+    :param port: The port to listen on, when no socket path is given. 0 picks a free one.
+    :param ready: An event to set once the server accepts clients.
+    """
+    compiled = roster.compiled()
+    compiled.users  # Built on first use, so it is built here and not during the first query
+    versions = await asyncio.get_running_loop().run_in_executor(None, load_versions, roster)
+
+    def handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        return _handle_client(roster, versions, reader, writer)
+
+    if socket_path is not None:
+        server = await asyncio.start_unix_server(handler, socket_path, limit=MAX_LINE)
+    else:
+        server = await asyncio.start_server(handler, host, port, limit=MAX_LINE)
+    async with server:
+        if ready is not None:
+            ready.set()
+        await server.serve_forever()
+
+
+async def _open(socket_path: str | None, host: str, port: int) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    Connect to a server.
+
+    :param socket_path: The path of the Unix socket, or None to connect to host and port.
+    :param host: The address of the server, when no socket path is given.
+    :param port: The port of the server, when no socket path is given.
+    :return: The reader and writer of the connection.
+    """
+    if socket_path is not None:
+        return await asyncio.open_unix_connection(socket_path, limit=MAX_LINE)
+    return await asyncio.open_connection(host, port, limit=MAX_LINE)
+
+
+def make_queries(roster: Roster, count: int = 1000, seed: int = 0) -> list[dict]:
+    """
+    Generate a mix of requests like the ones of a live game: mostly best options, some evolutions and bills.
+
+    :param roster: The Roster to pick names from.
+    :param count: The number of requests.
+    :param seed: The seed of the random generator.
+    :return: The requests.
+    """
+    rng = random.Random(seed)
+    names = [char.name for char in roster]
+    retorno = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.6:
+            request = {"op": "best", "owned": [rng.choice(names) for _ in range(rng.randint(5, 30))], "k": 5}
+        elif kind < 0.8:
+            request = {"op": "evolutions", "name": rng.choice(names)}
+        else:
+            request = {"op": "bill", "name": rng.choice(names)}
+        request["id"] = i
+        retorno.append(request)
+    return retorno
+
+
+async def load_test(queries: list[dict], clients: int = 4, pipeline: int = 16, socket_path: str | None = None,
+                    host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> dict[str, float]:
+    """
+    Measure a running server: each client sends the queries in batches of pipeline requests, then reads the
+    responses of the batch.
+
+    :param queries: The requests each client sends, such as the result of make_queries().
+    :param clients: The number of concurrent clients.
+    :param pipeline: How many requests each client sends before reading the responses.
+    :param socket_path: The path of the Unix socket, or None to connect to host and port.
+    :param host: The address of the server, when no socket path is given.
+    :param port: The port of the server, when no socket path is given.
+    :return: The number of requests and errors, the requests per second and the p50 and p99 round trips of a
+             batch, in milliseconds.
+    :raises ValueError: If the pipeline is smaller than 1.
+    """
+    if pipeline < 1:
+        raise ValueError("Expected pipeline of at least 1, got " + str(pipeline))
+    batches = [b"".join(json.dumps(query).encode() + b"\n" for query in queries[i:i + pipeline])
+               for i in range(0, len(queries), pipeline)]
+    sizes = [len(queries[i:i + pipeline]) for i in range(0, len(queries), pipeline)]
+    round_trips = []
+    errors = 0
+
+    async def client() -> None:
+        nonlocal errors
+        reader, writer = await _open(socket_path, host, port)
+        try:
+            for batch, size in zip(batches, sizes):
+                start = time.perf_counter()
+                writer.write(batch)
+                await writer.drain()
+                for _ in range(size):
+                    if not json.loads(await reader.readline())["ok"]:
+                        errors += 1
+                round_trips.append(time.perf_counter() - start)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    round_trips.sort()
+    requests = len(queries) * clients
+    return {"requests": requests, "errors": errors, "qps": requests / elapsed,
+            "p50_ms": statistics.median(round_trips) * 1000,
+            "p99_ms": round_trips[min(len(round_trips) - 1, int(len(round_trips) * 0.99))] * 1000}
+
+
+def main() -> int:
+    """
+    Run the server, or the load generator against a running server, from the command line.
+
+    :return: The exit code.
+    """
+    parser = argparse.ArgumentParser(description="ORD-Helper query server")
+    parser.add_argument("command", choices=("serve", "load"))
+    parser.add_argument("--socket", default=None, help="Unix socket path, instead of a local TCP port")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--clients", type=int, default=4, help="concurrent clients of the load generator")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per client of the load generator")
+    parser.add_argument("--pipeline", type=int, default=16, help="requests sent before reading the responses")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--map-version", default=DEFAULT_VERSION, metavar="NAME",
+                        help=f"map version of the served roster ({DEFAULT_VERSION} by default)")
+    parser.add_argument("--cache", nargs="?", const="", default=None, metavar="PATH",
+                        help="keep the best options in a persistent cache, shared across restarts")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            roster = get_roster(args.map_version)
+        except NameError as error:
+            parser.error(str(error))
+        if args.cache is not None:
+            from cache import DEFAULT_PATH, ResultCache  # Only needed with a persistent cache
+
+            roster.persistent = ResultCache(args.cache or DEFAULT_PATH)
+        try:
+            asyncio.run(serve(roster, args.socket, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    queries = make_queries(get_roster(), args.requests, args.seed)
+    results = asyncio.run(load_test(queries, args.clients, args.pipeline, args.socket, args.host, args.port))
+    print(f"{results['requests']} requests, {results['errors']} errors: {results['qps']:.0f} requests/s, "
+          f"batch round trip p50 {results['p50_ms']:.2f} ms, p99 {results['p99_ms']:.2f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
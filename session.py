@@ -0,0 +1,157 @@
+from array import array
+from bisect import bisect_left, insort
+from typing import Iterable
+
+from character import Character, Rank, as_roster, get_quantity
+from engine import missing_units
+
+
+class Session:
+    """
+    A class to follow one player's inventory during a game, keeping the ranking of the targets up to date.
+
+    Each event only re-evaluates the targets whose recipe uses a changed character, found through a
+    character -> targets index, and the top options are rebuilt once per event, so reading them is free.
+    """
+
+    def __init__(self, char_list: list[Character], owned: list[Character] = (), top_n: int = 5,
+                 rank: Rank | Iterable[Rank] = Rank.LEGENDARY):
+        """
+        Initialize the Session object.
+
+        :param char_list: The list of potential Character objects to evaluate.
+        :param owned: A list of already owned Character objects.
+        :param top_n: How many of the best options to keep ready.
+        :param rank: The rank, or ranks, of the characters to evaluate.
+        """
+        roster = as_roster(char_list)
+        self.compiled = roster.compiled(rank)
+        self.top_n = top_n
+        self.counts = self.compiled.encode(owned)
+
+        self._target_indices = {target_id: i for i, target_id in enumerate(self.compiled.target_ids)}
+        # Character ID -> indices of the targets with that character anywhere in their recipe
+        self._users = [[] for _ in self.compiled.characters]
+        for target_index, (_, node_ids, _, _) in enumerate(self.compiled.programs):
+            for char_id in set(node_ids):
+                self._users[char_id].append(target_index)
+
+        self._missing = [self.compiled.allocate(i, array("l", self.counts))[1]
+                         for i in range(len(self.compiled.targets))]
+        self._ranking = sorted((missing_units(missing), i) for i, missing in enumerate(self._missing))
+        self._top = []
+        self._refresh_top()
+
+    @property
+    def top(self) -> list[tuple[Character, list]]:
+        """
+        The best options for the current inventory, as find_best_char_opt would rank them.
+
+        :return: A list of up to top_n tuples, each containing a Character and a list of its missing common materials.
+        """
+        return self._top
+
+    def count(self, character: Character | str) -> int:
+        """
+        Get how many units of a character the inventory has.
+
+        :param character: The Character, or its name, to count.
+        :return: The number of owned units.
+        """
+        return self.counts[self._id_of(character)]
+
+    def missing(self, target: Character | str) -> list:
+        """
+        Get the missing common materials of one target for the current inventory.
+
+        :param target: The target Character, or its name.
+        :return: A list of common materials that are still missing.
+        :raises NameError: If the character is not a target of the roster.
+        """
+        target_index = self._target_indices.get(self._id_of(target))
+        if target_index is None:
+            raise NameError("Character not found")
+        return self.compiled.materialize_positions(target_index, self._missing[target_index])
+
+    def add(self, character: Character | str, amount: int = 1) -> None:
+        """
+        Add characters to the inventory, such as a wisp roll or a bought unit.
+
+        :param character: The Character, or its name, to add. Numeric resources add their own quantity each.
+        :param amount: How many of them to add.
+        """
+        char_id = self._id_of(character)
+        units = amount if isinstance(character, str) else amount * get_quantity(character)
+        self._apply({char_id: units})
+
+    def remove(self, character: Character | str, amount: int = 1) -> None:
+        """
+        Remove characters from the inventory, such as a sold unit.
+
+        :param character: The Character, or its name, to remove. Numeric resources remove their own quantity each.
+        :param amount: How many of them to remove.
+        :raises ValueError: If the inventory does not have that many.
+        """
+        char_id = self._id_of(character)
+        units = amount if isinstance(character, str) else amount * get_quantity(character)
+        self._apply({char_id: -units})
+
+    def merge(self, character: Character | str) -> None:
+        """
+        Merge a character from its direct materials, which are taken from the inventory.
+
+        :param character: The Character, or its name, to merge.
+        :raises ValueError: If the inventory does not have all the materials.
+        """
+        char_id = self._id_of(character)
+        changes = {char_id: 1}
+        for material in self.compiled.characters[char_id].materials:
+            material_id = self._id_of(material)
+            changes[material_id] = changes.get(material_id, 0) - get_quantity(material)
+        self._apply(changes)
+
+    def _id_of(self, character: Character | str) -> int:
+        """
+        Get the character ID of a Character or name.
+
+        :param character: The Character, or its name.
+        :return: The character ID in the compiled roster.
+        :raises NameError: If the character is not in the roster.
+        """
+        char_id = self.compiled.ids.get(character if isinstance(character, str) else character.name)
+        if char_id is None:
+            raise NameError("Character not found")
+        return char_id
+
+    def _apply(self, changes: dict[int, int]) -> None:
+        """
+        Change the inventory and re-evaluate the targets that use any of the changed characters.
+
+        :param changes: Character ID -> units to add (or remove, if negative).
+        :raises ValueError: If the inventory would have a negative count. Nothing is changed in that case.
+        """
+        for char_id, units in changes.items():
+            if self.counts[char_id] + units < 0:
+                raise ValueError("Not enough " + self.compiled.characters[char_id].name + " owned")
+        affected = set()
+        for char_id, units in changes.items():
+            self.counts[char_id] += units
+            affected.update(self._users[char_id])
+
+        for target_index in affected:
+            old_entry = (missing_units(self._missing[target_index]), target_index)
+            self._missing[target_index] = self.compiled.allocate(target_index, array("l", self.counts))[1]
+            new_entry = (missing_units(self._missing[target_index]), target_index)
+            if new_entry != old_entry:
+                del self._ranking[bisect_left(self._ranking, old_entry)]
+                insort(self._ranking, new_entry)
+        if affected:
+            self._refresh_top()
+
+    def _refresh_top(self) -> None:
+        """
+        Rebuild the best options from the first entries of the ranking.
+        """
+        self._top = [(self.compiled.targets[target_index],
+                      self.compiled.materialize_positions(target_index, self._missing[target_index]))
+                     for _, target_index in self._ranking[:self.top_n]]
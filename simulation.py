@@ -0,0 +1,178 @@
+import os
+import random
+from bisect import bisect_right
+from itertools import repeat
+from typing import Iterable
+
+from character import Character, Rank, as_roster
+from engine import CompiledRoster
+from profiling import instrument
+
+# Trials run by estimate_rolls() when no number is given
+DEFAULT_TRIALS = 2000
+
+# Trials of each chunk. Every chunk has its own seed, derived from the seed of the run, so the results are the same
+# whether the chunks run in this process or on a process pool
+CHUNK_TRIALS = 250
+
+# Runs with fewer trials than this are simulated without a process pool
+PARALLEL_TRIALS = 20000
+
+# Percentiles of the completion rolls reported by each Estimate
+PERCENTILES = (0.1, 0.5, 0.9, 0.99)
+
+
+class Estimate:
+    """
+    A class to represent how many Wisp rolls a target is expected to need before all its missing commons are owned.
+    """
+
+    def __init__(self, target: Character, missing: list, unrollable: list, rolls: list[int]):
+        """
+        Initialize the Estimate object.
+
+        :param target: The target Character.
+        :param missing: Its missing common materials for the current inventory.
+        :param unrollable: The missing materials that Wisp rolls cannot give, such as Wood.
+        :param rolls: The rolls each trial needed, sorted in ascending order.
+        """
+        self.target = target
+        self.missing = missing
+        self.unrollable = unrollable
+        self.rolls = rolls
+        self.mean = sum(rolls) / len(rolls) if rolls else 0.0
+        # Nearest-rank percentiles of the completion rolls
+        self.percentiles = {fraction: rolls[min(len(rolls) - 1, max(0, round(fraction * len(rolls)) - 1))]
+                            if rolls else 0 for fraction in PERCENTILES}
+
+    def probability_within(self, rolls: int) -> float:
+        """
+        Get the chance of finishing the target within a number of rolls.
+
+        :param rolls: The number of rolls.
+        :return: The fraction of trials that finished within that many rolls.
+        """
+        return bisect_right(self.rolls, rolls) / len(self.rolls) if self.rolls else 1.0
+
+    def __repr__(self):
+        """
+        Define the formal representation of the Estimate.
+
+        :return: The target with its expected rolls and median.
+        """
+        return f"Estimate({self.target.name!r}, mean={self.mean:.1f}, p50={self.percentiles[0.5]})"
+
+
+def rollable_commons(compiled: CompiledRoster) -> list[int]:
+    """
+    Find the commons that a Wisp roll can give: the COMMON characters made from a Wisp.
+    Each of them is assumed to be equally likely.
+
+    :param compiled: The CompiledRoster to look in.
+    :return: Their character IDs, in order.
+    """
+    return [char_id for char_id in compiled.by_rank.get(Rank.COMMON, [])
+            if any(material.rank == Rank.WISP for material in compiled.characters[char_id].materials)]
+
+
+def _simulate_chunk(seed: int, trials: int, demands: list[tuple[tuple[int, int], ...]],
+                    pool_size: int) -> list[list[int]]:
+    """
+    Simulate Wisp rolls for every target at once. Each trial draws one sequence of rolls, in batches, until every
+    target is done, and the rolls a target needs are the position of the last common it was waiting for.
+
+    :param seed: The seed of this chunk.
+    :param trials: The number of trials.
+    :param demands: For each target, (pool index, units) pairs of the rollable commons it is missing.
+    :param pool_size: The number of rollable commons.
+    :return: For each target, the rolls each trial needed.
+    """
+    rng = random.Random(seed)
+    pool = range(pool_size)
+    needed = [0] * pool_size  # The most units of each common that any target is missing
+    for demand in demands:
+        for index, units in demand:
+            needed[index] = max(needed[index], units)
+    batch = max(16, sum(needed))  # No trial can finish in fewer rolls than this
+
+    retorno = [[] for _ in demands]
+    for _ in range(trials):
+        occurrences = [[] for _ in pool]  # Pool index -> roll positions at which it came, up to what is needed
+        waiting = sum(1 for units in needed if units)
+        position = 0
+        while waiting:
+            for index in rng.choices(pool, k=batch):
+                positions = occurrences[index]
+                if len(positions) < needed[index]:
+                    positions.append(position)
+                    if len(positions) == needed[index]:
+                        waiting -= 1
+                        if not waiting:
+                            break
+                position += 1
+        for samples, demand in zip(retorno, demands):
+            samples.append(max((occurrences[index][units - 1] + 1 for index, units in demand), default=0))
+    return retorno
+
+
+@instrument
+def estimate_rolls(char_list: list[Character], owned: list[Character], trials: int = DEFAULT_TRIALS, seed: int = 0,
+                   rank: Rank | Iterable[Rank] = Rank.LEGENDARY, max_workers: int | None = None) -> list[Estimate]:
+    """
+    Estimate how many Wisp rolls every target needs from the current inventory, by Monte Carlo simulation.
+    Unlike counting missing commons, this tells apart targets that wait on several copies of the same common.
+
+    The owned characters are used as in find_best_char_opt, then the missing rollable commons of each target are
+    drawn from uniform Wisp rolls. Missing materials that no roll can give are listed in Estimate.unrollable and
+    are not part of the estimate.
+
+    :param char_list: The list of potential Character objects to evaluate.
+    :param owned: A list of already owned Character objects.
+    :param trials: The number of simulated roll sequences.
+    :param seed: The seed of the run. The same seed always gives the same estimates, with or without a pool.
+    :param rank: The rank, or ranks, of the characters to evaluate.
+    :param max_workers: The number of worker processes for large runs. Defaults to the number of CPUs.
+    :return: One Estimate per target, sorted by expected rolls.
+    :raises ValueError: If the number of trials is smaller than 1.
+    """
+    if trials < 1:
+        raise ValueError("Expected at least 1 trial, got " + str(trials))
+    roster = as_roster(char_list)
+    compiled = roster.compiled(rank)
+    pool = {char_id: index for index, char_id in enumerate(rollable_commons(compiled))}
+
+    demands = []
+    unrollable = []
+    ranked = sorted(compiled.rank(compiled.encode(owned)), key=lambda x: x[0])  # In order of target index
+    for target_index, positions in ranked:
+        node_ids = compiled.programs[target_index][1]
+        demand = {}
+        others = []
+        for position, units in positions:
+            index = pool.get(node_ids[position])
+            if index is None:
+                others.append((position, units))
+            else:
+                demand[index] = demand.get(index, 0) + units
+        demands.append(tuple(sorted(demand.items())))
+        unrollable.append(others)
+
+    # Chunks and their seeds only depend on the seed and the number of trials
+    rng = random.Random(seed)
+    sizes = [min(CHUNK_TRIALS, trials - start) for start in range(0, trials, CHUNK_TRIALS)]
+    seeds = [rng.getrandbits(64) for _ in sizes]
+    if trials >= PARALLEL_TRIALS and (max_workers or os.cpu_count() or 1) > 1:
+        from concurrent.futures import ProcessPoolExecutor  # Only needed for large runs
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_simulate_chunk, seeds, sizes, repeat(demands), repeat(len(pool))))
+    else:
+        results = [_simulate_chunk(chunk_seed, size, demands, len(pool)) for chunk_seed, size in zip(seeds, sizes)]
+
+    retorno = []
+    for target_index, positions in ranked:
+        samples = sorted(rolls for result in results for rolls in result[target_index])
+        retorno.append(Estimate(compiled.targets[target_index], compiled.materialize_positions(target_index, positions),
+                                compiled.materialize_positions(target_index, unrollable[target_index]), samples))
+    retorno.sort(key=lambda estimate: estimate.mean)
+    return retorno
@@ -0,0 +1,312 @@
+import hashlib
+import marshal
+import mmap
+import os
+import sys
+import threading
+from array import array
+
+from character import Character, Rank, Roster, count_materials
+from engine import CompiledRoster
+from profiling import instrument
+
+# Bump when the layout of the snapshot changes
+SNAPSHOT_VERSION = 4
+
+# Files that define the compiled form of every roster. A change in any of them, or in the module of the map version,
+# rebuilds the snapshot
+SOURCE_FILES = ("character.py", "engine.py")
+
+# Map versions: the default one is set up by all_characters.py, and each all_characters_<version>.py next to it,
+# with its own setup(), adds another one
+DEFAULT_VERSION = "current"
+VERSION_PREFIX = "all_characters_"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(BASE_DIR, "__pycache__", "roster.snapshot")
+
+_store = None  # Shared RosterStore of get_roster(), created on first use
+_store_lock = threading.Lock()
+
+
+def available_versions() -> list[str]:
+    """
+    List the map versions that have a roster module.
+
+    :return: The default version, then the others in alphabetical order.
+    """
+    return [DEFAULT_VERSION] + sorted(file_name[len(VERSION_PREFIX):-3] for file_name in os.listdir(BASE_DIR)
+                                      if file_name.startswith(VERSION_PREFIX) and file_name.endswith(".py"))
+
+
+def version_module(version: str = DEFAULT_VERSION) -> str:
+    """
+    Get the module that sets up the roster of a map version.
+
+    :param version: The name of the version.
+    :return: The module name, such as "all_characters".
+    :raises NameError: If the version has no roster module.
+    """
+    if version == DEFAULT_VERSION:
+        return "all_characters"
+    if version not in available_versions():
+        raise NameError("Version not found: " + version)
+    return VERSION_PREFIX + version
+
+
+def snapshot_path(version: str = DEFAULT_VERSION, directory: str = os.path.dirname(DEFAULT_PATH)) -> str:
+    """
+    Get where the snapshot of a map version is stored.
+
+    :param version: The name of the version.
+    :param directory: The directory of the snapshots.
+    :return: The path of the snapshot file.
+    """
+    return os.path.join(directory, "roster.snapshot" if version == DEFAULT_VERSION else f"roster-{version}.snapshot")
+
+
+def source_digest(version: str = DEFAULT_VERSION) -> str:
+    """
+    Hash the source files of the roster, so a snapshot built from other sources is never used.
+
+    :param version: The map version whose roster module is hashed.
+    :return: A hexadecimal SHA-256 digest.
+    :raises NameError: If the version has no roster module.
+    """
+    digest = hashlib.sha256()
+    for file_name in (version_module(version) + ".py",) + SOURCE_FILES:
+        with open(os.path.join(BASE_DIR, file_name), "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def _header(digest: str) -> tuple:
+    """
+    Build the header that a snapshot must match to be loaded.
+
+    :param digest: The result of source_digest().
+    :return: A tuple with everything the stored bytes depend on.
+    """
+    return SNAPSHOT_VERSION, digest, marshal.version, array("l").itemsize, sys.byteorder
+
+
+def dump_roster(roster: Roster, digest: str) -> bytes:
+    """
+    Serialize a roster, with its precomputed bills and its compiled form, into a snapshot.
+    Materials are stored as (character ID, other) pairs, so copies like Wood multiplied by 3 keep their quantity.
+
+    :param roster: The Roster to serialize.
+    :param digest: The result of source_digest() for the sources the roster was built from.
+    :return: The snapshot bytes.
+    :raises ValueError: If a recipe uses a character that is not in the roster.
+    """
+    ids = {}
+    for char_id, char in enumerate(roster):
+        ids.setdefault(char.name, char_id)
+
+    def ref(material: Character) -> tuple:
+        if material.name not in ids:
+            raise ValueError("A recipe uses a character that is not in the roster: " + material.name)
+        return ids[material.name], material.other
+
+    characters = tuple((char.name, char.rank.name, char.command, char.other,
+                        tuple(ref(material) for material in char.materials),
+                        tuple(ref(material) for material in char.all_commons),
+                        char.bill)
+                       for char in roster)
+    compiled = roster.compiled()
+    target_ranks = tuple(rank.name for rank in compiled.target_ranks)
+    return marshal.dumps((_header(digest), characters, target_ranks, compiled.get_state()))
+
+
+def load_snapshot(data: bytes, digest: str) -> Roster | None:
+    """
+    Rebuild a roster from a snapshot, without running setup().
+
+    :param data: The snapshot bytes from dump_roster().
+    :param digest: The result of source_digest() for the current sources.
+    :return: The Roster, with its compiled form ready, or None if the snapshot is stale or unreadable.
+    """
+    try:
+        header, characters, target_ranks, state = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        return None
+    if header != _header(digest):
+        return None
+
+    chars = [Character(name, Rank[rank], (), command, other) for name, rank, command, other, _, _, _ in characters]
+
+    def resolve(char_id: int, other) -> Character:
+        char = chars[char_id]
+        if other != char.other:
+            char = Character(char.name, char.rank, char.materials, char.command, other)
+        return char
+
+    # Materials are first set to the plain characters, so copies made by resolve() have a recipe in any order
+    for char, (_, _, _, _, materials, _, _) in zip(chars, characters):
+        char.materials = tuple(chars[char_id] for char_id, _ in materials)
+    for char, (_, _, _, _, materials, all_commons, bill) in zip(chars, characters):
+        char.materials = tuple(resolve(char_id, other) for char_id, other in materials)
+        # The bills were computed bottom-up when the snapshot was built, so they are restored as they are
+        char._all_commons = tuple(resolve(char_id, other) for char_id, other in all_commons)
+        char._bill = bill
+
+    roster = Roster(chars)
+    roster.use_compiled(CompiledRoster(chars, [Rank[rank] for rank in target_ranks], state))
+    return roster
+
+
+@instrument
+def load_roster(path: str | None = None, version: str = DEFAULT_VERSION) -> Roster:
+    """
+    Get the roster of a map version from its snapshot, or build it with the setup() of the version and write a new
+    snapshot if the sources changed. The snapshot is read through a memory map, so it is not copied before decoding.
+
+    :param path: Where the snapshot is stored. Defaults to snapshot_path(version).
+    :param version: The name of the map version.
+    :return: The Roster of all characters of the version.
+    :raises NameError: If the version has no roster module.
+    """
+    if path is None:
+        path = snapshot_path(version)
+    digest = source_digest(version)
+    try:
+        with open(path, "rb") as snapshot, mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            roster = load_snapshot(data, digest)
+    except (OSError, ValueError):  # Missing or empty
+        roster = None
+    if roster is not None:
+        return roster
+
+    import importlib  # Only needed when the snapshot has to be rebuilt
+
+    roster = importlib.import_module(version_module(version)).setup()
+    try:
+        data = dump_roster(roster, digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so a reader never sees half a snapshot
+        temporary_path = path + "." + str(os.getpid()) + ".tmp"
+        with open(temporary_path, "wb") as snapshot:
+            snapshot.write(data)
+        os.replace(temporary_path, path)
+    except (OSError, ValueError):
+        pass  # The snapshot only speeds up the next start, so the roster is still usable without it
+    return roster
+
+
+class RosterStore:
+    """
+    A class to keep the rosters of several map versions, each one loaded once from its own snapshot.
+    Switching between loaded versions, or comparing their recipes, never runs setup() again.
+    Safe to use from several threads: each version is only loaded once.
+    """
+
+    def __init__(self, directory: str = os.path.dirname(DEFAULT_PATH)):
+        """
+        Initialize the RosterStore object, without loading any version.
+
+        :param directory: The directory of the snapshots.
+        """
+        self.directory = directory
+        self._rosters = {}  # Version name -> Roster
+        self._lock = threading.Lock()
+
+    def versions(self) -> list[str]:
+        """
+        :return: The names of the available map versions, loaded or not.
+        """
+        return available_versions()
+
+    def get(self, version: str = DEFAULT_VERSION) -> Roster:
+        """
+        Get the roster of a map version, loading it the first time it is needed.
+
+        :param version: The name of the version.
+        :return: The Roster of all characters of the version.
+        :raises NameError: If the version has no roster module.
+        """
+        roster = self._rosters.get(version)
+        if roster is None:
+            with self._lock:
+                roster = self._rosters.get(version)
+                if roster is None:
+                    roster = load_roster(snapshot_path(version, self.directory), version)
+                    self._rosters[version] = roster
+        return roster
+
+    def diff(self, old: str, new: str) -> dict[str, list]:
+        """
+        Compare the recipes of two map versions.
+
+        :param old: The name of the older version.
+        :param new: The name of the newer version.
+        :return: A dictionary with "added" and "removed", the names of the characters only in one version, and
+                 "changed", (name, old recipe, new recipe) tuples of the characters whose rank or materials differ.
+                 Recipes are (rank name, ((material name, quantity), ...)) tuples.
+        :raises NameError: If a version has no roster module.
+        """
+        old_recipes = _recipes(self.get(old))
+        new_recipes = _recipes(self.get(new))
+        return {"added": [name for name in new_recipes if name not in old_recipes],
+                "removed": [name for name in old_recipes if name not in new_recipes],
+                "changed": [(name, old_recipes[name], recipe) for name, recipe in new_recipes.items()
+                            if name in old_recipes and old_recipes[name] != recipe]}
+
+
+def _recipes(roster: Roster) -> dict[str, tuple]:
+    """
+    Get the recipe of every character of a roster, comparable across versions.
+
+    :param roster: The Roster to read.
+    :return: Name -> (rank name, ((material name, quantity), ...)), in roster order. The first character of each name
+             is used, as Roster.get() does.
+    """
+    retorno = {}
+    for char in roster:
+        if char.name not in retorno:
+            retorno[char.name] = (char.rank.name, count_materials(char.materials))
+    return retorno
+
+
+def format_diff(diff: dict[str, list]) -> str:
+    """
+    Format the result of RosterStore.diff() for people, one line per character.
+
+    :param diff: The result of RosterStore.diff().
+    :return: The formatted lines, or "No differences".
+    """
+    lines = ["+ " + name for name in diff["added"]] + ["- " + name for name in diff["removed"]]
+    for name, (old_rank, old_materials), (new_rank, new_materials) in diff["changed"]:
+        line = "~ " + name + ":"
+        if old_rank != new_rank:
+            line += f" {old_rank} -> {new_rank}"
+        if old_materials != new_materials:
+            line += f" {dict(old_materials)} -> {dict(new_materials)}"
+        lines.append(line)
+    return "\n".join(lines) or "No differences"
+
+
+def get_store() -> RosterStore:
+    """
+    Get the shared store of every map version, creating it the first time it is needed.
+
+    :return: The shared RosterStore.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = RosterStore()
+    return _store
+
+
+def get_roster(version: str = DEFAULT_VERSION) -> Roster:
+    """
+    Get the shared roster of all characters of a map version, loading it the first time it is needed.
+    Safe to call from several threads: each roster is only loaded once.
+
+    :param version: The name of the map version.
+    :return: The Roster of all characters.
+    :raises NameError: If the version has no roster module.
+    """
+    return get_store().get(version)
@@ -0,0 +1,164 @@
+from typing import Iterable
+
+from character import Character, Rank, as_roster
+from engine import CompiledRoster
+from profiling import instrument
+from simulation import rollable_commons
+
+# Rolls looked at by what_if() when no lookahead is given
+DEFAULT_LOOKAHEAD = 1
+
+
+class MarginalValue:
+    """
+    A class to represent how much acquiring one more unit of a base material, such as a common from the next Wisp
+    roll, would help every target.
+    """
+
+    def __init__(self, candidate: Character, targets: list, deltas: list[int], best: int, expected_best: float):
+        """
+        Initialize the MarginalValue object.
+
+        :param candidate: The Character that would be acquired.
+        :param targets: The targets, in the order of the deltas.
+        :param deltas: The change in missing units of each target, 0 or negative.
+        :param best: The missing units of the best option once the candidate is acquired.
+        :param expected_best: The expected missing units of the best option after the candidate and the random rolls
+                              of the lookahead.
+        """
+        self.candidate = candidate
+        self.targets = targets
+        self.deltas = deltas
+        self.best = best
+        self.expected_best = expected_best
+        self.improved = sum(1 for delta in deltas if delta)  # Targets that the candidate brings closer
+
+    def changes(self) -> list[tuple[Character, int]]:
+        """
+        :return: The (target, change in missing units) pairs of the targets the candidate brings closer.
+        """
+        return [(target, delta) for target, delta in zip(self.targets, self.deltas) if delta]
+
+    def __repr__(self):
+        """
+        Define the formal representation of the MarginalValue.
+
+        :return: The candidate with the best option it leads to and how many targets it helps.
+        """
+        return (f"MarginalValue({self.candidate.name!r}, best={self.best}, expected_best={self.expected_best:.2f}, "
+                f"improved={self.improved})")
+
+
+class _Lookahead:
+    """
+    A class to compute the expected missing units of the best option after random rolls, memoized by the multiset of
+    acquired columns, since the order in which commons come does not change the result.
+    """
+
+    def __init__(self, missing_rows: list, pool: list[int]):
+        """
+        Initialize the _Lookahead object.
+
+        :param missing_rows: The result of CompiledRoster.missing_by_column() for the current inventory.
+        :param pool: The columns that a roll can give, each one equally likely.
+        """
+        self.missing_rows = missing_rows
+        self.pool = pool
+        self.totals = [sum(row) for row in missing_rows]
+        self._best = {}  # Sorted tuple of acquired columns -> missing units of the best option
+        self._expected = {}  # (sorted tuple of acquired columns, rolls left) -> expected missing units
+
+    def best(self, acquired: tuple[int, ...]) -> int:
+        """
+        Get the missing units of the best option after acquiring some base materials.
+
+        :param acquired: The acquired columns, sorted, with repetitions.
+        :return: The fewest missing units of any target.
+        """
+        retorno = self._best.get(acquired)
+        if retorno is None:
+            units = {}
+            for column in acquired:
+                units[column] = units.get(column, 0) + 1
+            retorno = min((total - sum(min(amount, row[column]) for column, amount in units.items())
+                           for total, row in zip(self.totals, self.missing_rows)), default=0)
+            self._best[acquired] = retorno
+        return retorno
+
+    def expected(self, acquired: tuple[int, ...], rolls: int) -> float:
+        """
+        Get the expected missing units of the best option after some more random rolls.
+
+        :param acquired: The acquired columns, sorted, with repetitions.
+        :param rolls: The rolls left.
+        :return: The mean of the best option over every outcome of the rolls.
+        """
+        if not rolls or not self.pool:
+            return self.best(acquired)
+        key = (acquired, rolls)
+        retorno = self._expected.get(key)
+        if retorno is None:
+            retorno = sum(self.expected(tuple(sorted(acquired + (column,))), rolls - 1)
+                          for column in self.pool) / len(self.pool)
+            self._expected[key] = retorno
+        return retorno
+
+
+@instrument
+def what_if(char_list: list[Character], owned: list[Character], candidates: Iterable[Character | str] | None = None,
+            lookahead: int = DEFAULT_LOOKAHEAD,
+            rank: Rank | Iterable[Rank] = Rank.LEGENDARY) -> list[MarginalValue]:
+    """
+    Find which next acquisition would help the most, without running find_best_char_opt once per candidate.
+
+    The missing units of each base material are counted once for every target. Acquiring a base material only
+    covers its own missing units, so the change of every target under every candidate comes from that table.
+    With a lookahead of two or three, each candidate is also scored by the expected best option after the next
+    random Wisp rolls, which are memoized by the commons they give.
+
+    :param char_list: The list of potential Character objects to evaluate.
+    :param owned: A list of already owned Character objects, or an Inventory.
+    :param candidates: The base materials that could be acquired, as Character objects or names. Defaults to the
+                       commons a Wisp roll can give.
+    :param lookahead: The number of acquisitions to look at: the candidate, then lookahead - 1 random rolls.
+    :param rank: The rank, or ranks, of the characters to evaluate.
+    :return: One MarginalValue per candidate, the most helpful first.
+    :raises NameError: If a candidate is not in the roster.
+    :raises ValueError: If a candidate is not a base material, or the lookahead is smaller than 1.
+    """
+    if lookahead < 1:
+        raise ValueError("Expected a lookahead of at least 1, got " + str(lookahead))
+    roster = as_roster(char_list)
+    compiled = roster.compiled(rank)
+    pool = [compiled.columns[char_id] for char_id in rollable_commons(compiled)]
+    columns = pool if candidates is None else [_column_of(compiled, candidate) for candidate in candidates]
+
+    missing_rows = compiled.missing_by_column(compiled.encode(owned))
+    search = _Lookahead(missing_rows, pool)
+    retorno = []
+    for column in columns:
+        deltas = [-1 if row[column] else 0 for row in missing_rows]
+        retorno.append(MarginalValue(compiled.materials[column], compiled.targets, deltas, search.best((column,)),
+                                     search.expected((column,), lookahead - 1)))
+    retorno.sort(key=lambda value: (value.expected_best, value.best, -value.improved))
+    return retorno
+
+
+def _column_of(compiled: CompiledRoster, candidate: Character | str) -> int:
+    """
+    Get the column of a candidate acquisition.
+
+    :param compiled: The CompiledRoster to look in.
+    :param candidate: The Character, or its name.
+    :return: The column of the base material.
+    :raises NameError: If the candidate is not in the roster.
+    :raises ValueError: If it is not a base material.
+    """
+    name = candidate if isinstance(candidate, str) else candidate.name
+    char_id = compiled.ids.get(name)
+    if char_id is None:
+        raise NameError("Character not found")
+    column = compiled.columns[char_id]
+    if column < 0:
+        raise ValueError("Only base materials can be acquired one unit at a time, got " + name)
+    return column